@@ -0,0 +1,266 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from scheduler_manager import get_scheduler
+
+# ==========================================
+# 1. 进程级共享客户端 (连接池常驻)
+# ==========================================
+DEFAULT_BASE_URL = "https://api.deepseek.com"
+
+# HTTP 连接池参数：保持长连接，避免每次点击都重新握手
+POOL_MAX_CONNECTIONS = 32
+POOL_MAX_KEEPALIVE = 16
+POOL_KEEPALIVE_EXPIRY = 120.0
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 120.0
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(api_key, base_url=DEFAULT_BASE_URL):
+    """同一组 (key, base_url) 在进程内只建一个客户端，所有页面 / Session 共用"""
+    key = (api_key, base_url)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            import httpx
+            from openai import OpenAI
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+            )
+            # 重试交给 scheduler_manager 统一做 (带退避和期限)，SDK 自己不再重试
+            raw = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            _CLIENTS[key] = InstrumentedClient(raw)
+        return _CLIENTS[key]
+
+
+# ==========================================
+# 2. 调用指标
+# ==========================================
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+class Metrics:
+    """
+    按模型聚合：调用数、错误类型、token 数、总耗时 / 首 token 耗时分布，
+    以及请求发出前在调度器里排队 (限速 + 重试退避) 的时间分布。
+    耗时和首 token 都从最终成功的那次尝试发出时算起，不含排队
+    """
+
+    def __init__(self, recent=200):
+        self.lock = threading.Lock()
+        self.models = {}
+        self.recent = deque(maxlen=recent)
+
+    def _model(self, model):
+        if model not in self.models:
+            self.models[model] = {
+                "calls": 0, "errors": {}, "tokens_in": 0, "tokens_out": 0,
+                "latency_sum": 0.0, "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                "ttft_sum": 0.0, "ttft_count": 0, "ttft_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                "queue_sum": 0.0, "queue_count": 0, "queue_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+            }
+        return self.models[model]
+
+    @staticmethod
+    def _bucket(buckets, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+                return
+        buckets[-1] += 1
+
+    def record(self, model, latency, ttft=None, tokens_in=0, tokens_out=0, error=None, stream=False, queue_wait=None):
+        with self.lock:
+            m = self._model(model)
+            if queue_wait is not None:
+                m["queue_sum"] += queue_wait
+                m["queue_count"] += 1
+                self._bucket(m["queue_buckets"], queue_wait)
+            m["calls"] += 1
+            m["latency_sum"] += latency
+            self._bucket(m["latency_buckets"], latency)
+            if ttft is not None:
+                m["ttft_sum"] += ttft
+                m["ttft_count"] += 1
+                self._bucket(m["ttft_buckets"], ttft)
+            m["tokens_in"] += tokens_in or 0
+            m["tokens_out"] += tokens_out or 0
+            if error:
+                m["errors"][error] = m["errors"].get(error, 0) + 1
+            self.recent.append({
+                "time": time.time(), "model": model, "stream": stream, "latency": round(latency, 3),
+                "ttft": round(ttft, 3) if ttft is not None else None,
+                "queue_wait": round(queue_wait, 3) if queue_wait is not None else None,
+                "tokens_in": tokens_in, "tokens_out": tokens_out, "error": error,
+            })
+
+    def snapshot(self):
+        with self.lock:
+            models = {}
+            for name, m in self.models.items():
+                models[name] = dict(
+                    m, errors=dict(m["errors"]),
+                    latency_avg=m["latency_sum"] / m["calls"] if m["calls"] else 0.0,
+                    ttft_avg=m["ttft_sum"] / m["ttft_count"] if m["ttft_count"] else None,
+                    queue_avg=m["queue_sum"] / m["queue_count"] if m["queue_count"] else None,
+                )
+            return {"models": models, "recent": list(self.recent)}
+
+    def prometheus(self):
+        """Prometheus 文本格式，方便直接抓取"""
+        lines = []
+        with self.lock:
+            for name, m in self.models.items():
+                label = f'model="{name}"'
+                lines.append(f"ai_calls_total{{{label}}} {m['calls']}")
+                lines.append(f"ai_tokens_in_total{{{label}}} {m['tokens_in']}")
+                lines.append(f"ai_tokens_out_total{{{label}}} {m['tokens_out']}")
+                for err, count in m["errors"].items():
+                    lines.append(f'ai_errors_total{{{label},error="{err}"}} {count}')
+                for metric, buckets, total, count in (
+                    ("ai_latency_seconds", m["latency_buckets"], m["latency_sum"], m["calls"]),
+                    ("ai_ttft_seconds", m["ttft_buckets"], m["ttft_sum"], m["ttft_count"]),
+                    ("ai_queue_wait_seconds", m["queue_buckets"], m["queue_sum"], m["queue_count"]),
+                ):
+                    running = 0
+                    for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                        running += n
+                        lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {running}')
+                    lines.append(f"{metric}_sum{{{label}}} {total:.6f}")
+                    lines.append(f"{metric}_count{{{label}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+# ==========================================
+# 3. 带埋点的客户端包装
+# ==========================================
+def _usage(obj):
+    usage = getattr(obj, "usage", None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+class _InstrumentedCompletions:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def create(self, **kwargs):
+        model = kwargs.get("model", "unknown")
+        queued = time.monotonic()
+        sent = [queued]
+        if kwargs.get("stream"):
+            # 让最后一个 chunk 带上 usage，流式调用也能统计 token
+            kwargs.setdefault("stream_options", {"include_usage": True})
+
+        def attempt():
+            # 每次尝试 (含重试) 的失败都单独计入指标
+            sent[0] = time.monotonic()
+            try:
+                return self.raw.create(**kwargs)
+            except Exception as e:
+                METRICS.record(model, time.monotonic() - sent[0], error=type(e).__name__,
+                               stream=bool(kwargs.get("stream")))
+                raise
+
+        # 限速、自适应并发与重试都在共享调度器里完成
+        res = get_scheduler().call(attempt, stream=bool(kwargs.get("stream")))
+        # sent[0] 此时是成功那次尝试的发出时间；之前的都是排队和退避
+        start, queue_wait = sent[0], sent[0] - queued
+
+        if kwargs.get("stream"):
+            return self._wrap_stream(res, model, start, queue_wait)
+        tokens_in, tokens_out = _usage(res)
+        latency = time.monotonic() - start
+        METRICS.record(model, latency, ttft=latency, tokens_in=tokens_in, tokens_out=tokens_out, queue_wait=queue_wait)
+        return res
+
+    def _wrap_stream(self, stream, model, start, queue_wait=None):
+        ttft = None
+        tokens_in = tokens_out = 0
+        error = None
+        try:
+            for chunk in stream:
+                if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                    ttft = time.monotonic() - start
+                if getattr(chunk, "usage", None):
+                    tokens_in, tokens_out = _usage(chunk)
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        except GeneratorExit:
+            error = "Cancelled"
+            raise
+        finally:
+            METRICS.record(model, time.monotonic() - start, ttft=ttft, tokens_in=tokens_in,
+                           tokens_out=tokens_out, error=error, stream=True, queue_wait=queue_wait)
+
+
+class InstrumentedClient:
+    """与 OpenAI 客户端用法一致 (client.chat.completions.create)，每次调用自动限流、重试并记录指标"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.chat = SimpleNamespace(completions=_InstrumentedCompletions(raw.chat.completions))
+
+
+# ==========================================
+# 4. 指标抓取端点 (可选)
+# ==========================================
+_SERVER = {}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(METRICS.snapshot(), ensure_ascii=False).encode("utf-8")
+            ctype = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = METRICS.prometheus().encode("utf-8")
+            ctype = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    后台线程提供 /metrics (Prometheus) 和 /metrics.json，同一进程只启动一次。
+    端口被占用 (比如第二个实例) 时只打印一次错误并返回 None，之后不再重试
+    """
+    with _CLIENTS_LOCK:
+        if port in _SERVER:
+            return _SERVER[port]
+        try:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"Metrics Server Error (port {port}): {e}")
+            _SERVER[port] = None
+            return None
+        threading.Thread(target=server.serve_forever, name="ai-metrics", daemon=True).start()
+        _SERVER[port] = server
+        return server
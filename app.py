@@ -3,8 +3,6 @@ import json
 import os
 import sys
 import pandas as pd
-from openai import OpenAI
-from github import Github  # 🔥 必须引入这个库
 # ===========================
 # 0. 基础路径 & 引入模块
 # ===========================
@@ -13,116 +11,39 @@ parent_dir = os.path.abspath(os.path.join(current_dir, '..'))
 if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
-from engine_manager import render_sidebar, WAREHOUSE, init_data
+from engine_manager import render_sidebar, WAREHOUSE, init_data, add_words, remove_words, get_warehouse_sync, get_ai_client
 from style_manager import apply_pro_style
+from ingest_manager import analyze_text, bulk_analyze, read_bulk_entries, get_ingest_cache
+from scheduler_manager import get_scheduler
 
-# ========================================================
-# 🔥 用这一段替换原来的 find_real_file_path 和 save_category_to_disk 🔥
-# ========================================================
-
-def find_remote_file_path(repo, category):
-    """在 GitHub 仓库里找真实文件路径 (自动匹配 styles_ 等前缀)"""
-    clean_cat = category.strip().lower()
-    candidates = [
-        f"{clean_cat}.txt",
-        f"styles_{clean_cat}.txt",
-        f"{clean_cat}s.txt",
-        f"styles_{clean_cat}s.txt",
-        f"text_{clean_cat}.txt"
-    ]
-    
-    # 搜索 graphic 和 text 目录
-    for d in ["data/graphic", "data/text"]:
-        try:
-            contents = repo.get_contents(d)
-            for file in contents:
-                if file.name.lower() in candidates:
-                    return file.path
-        except:
-            continue
-    # 默认路径
-    return f"data/graphic/{category}.txt"
-
-def save_category_to_disk(category, new_list):
+# ===========================
+# 1. GitHub 同步 (后台写回队列)
+# ===========================
+def sync_categories_to_github(categories):
     """
-    连接 GitHub 并提交修改 (Commit & Push)
+    登记需要同步的分类后立即返回，上传由后台线程合并完成
+    (连续多次编辑只会产生一次上传，状态见侧边栏)
     """
-    # 1. 获取 Secrets
-    try:
-        # 兼容 [general] 和直接格式
-        secrets = st.secrets["general"] if "general" in st.secrets else st.secrets
-        token = secrets["GITHUB_TOKEN"]
-        repo_name = secrets["REPO_NAME"]
-        branch = secrets.get("BRANCH", "main")
-    except KeyError:
+    queue = get_warehouse_sync()
+    if queue is None:
         st.error("❌ Secrets 配置缺失！请检查 GITHUB_TOKEN 和 REPO_NAME")
         return False
+    queue.enqueue(categories)
+    return True
 
-    # 2. 连接 GitHub
-    try:
-        g = Github(token)
-        repo = g.get_repo(repo_name)
-    except Exception as e:
-        st.error(f"❌ GitHub 连接失败: {e}")
-        return False
-
-    # 3. 准备数据
-    file_path = find_remote_file_path(repo, category)
-    content_str = "\n".join([str(x).strip() for x in new_list if str(x).strip()])
-    
-    # 4. 提交更新
-    msg_box = st.toast(f"⏳ 正在同步 GitHub: {file_path}...", icon="☁️")
-    
-    try:
-        # 尝试获取文件 (为了拿 sha 进行更新)
-        try:
-            contents = repo.get_contents(file_path, ref=branch)
-            repo.update_file(
-                path=contents.path,
-                message=f"Update {category} via App",
-                content=content_str,
-                sha=contents.sha,
-                branch=branch
-            )
-            time.sleep(1)
-            st.toast(f"✅ 同步成功！GitHub 已更新", icon="🎉")
-            return True
-        except:
-            # 文件不存在，创建新文件
-            repo.create_file(
-                path=file_path,
-                message=f"Create {category}",
-                content=content_str,
-                branch=branch
-            )
-            st.toast(f"✅ 新建成功！文件已创建", icon="✨")
-            return True
-            
-    except Exception as e:
-        st.error(f"💥 同步炸了: {e}")
-        return False
 # ===========================
 # 2. 页面初始化
 # ===========================
 st.set_page_config(layout="wide", page_title="Tattoo Engine V2")
 apply_pro_style()
 
-# 初始化数据
-if "db_all" not in st.session_state:
-    init_data()
+# 初始化数据 (共享词库视图，每次 rerun 都很便宜)
+init_data()
 
 render_sidebar()
 
-# 初始化 AI 客户端
-client = None
-if "DEEPSEEK_KEY" in st.secrets:
-    try:
-        client = OpenAI(
-            api_key=st.secrets["DEEPSEEK_KEY"],
-            base_url="https://api.deepseek.com"
-        )
-    except:
-        pass
+# 初始化 AI 客户端 (进程级共享)
+client = get_ai_client()
 
 # 初始化 Session State
 if "ai_results" not in st.session_state: st.session_state.ai_results = []
@@ -150,75 +71,98 @@ with col_ingest:
         label_visibility="collapsed"
     )
 
+    parse_mode = st.radio(
+        "Parse Mode",
+        ["Hybrid", "AI Only", "Offline"],
+        horizontal=True,
+        label_visibility="collapsed",
+        help="Hybrid：已知词本地识别，只把新词交给 AI；Offline：完全不调用 API"
+    )
+
     if st.button("✨ Start Analysis (DeepSeek)", use_container_width=True, type="primary"):
         if not st.session_state.input_text:
             st.warning("Input is empty.")
-        elif not client:
+        elif parse_mode != "Offline" and not client:
             st.error("DeepSeek API Key not found in .streamlit/secrets.toml")
         else:
+            # 本地词典先扫一遍，只把未知片段交给 AI
             with st.spinner("AI 正在解构你的灵感..."):
-                # 核心 Prompt
-                prompt = f"""
-                任务：将纹身描述文本拆解为结构化关键词。
-                
-                【重要规则】
-                1. 请务必区分：
-                   - Subject (主体): 具体的物体、生物 (如: 猫, 骷髅, 玫瑰)
-                   - StyleSystem (风格): 艺术流派 (如: 赛博朋克, Old School, 水墨)
-                   - Mood (情绪): 氛围感受 (如: 压抑, 欢快, 神圣)
-                   - Action (动作): 动态 (如: 奔跑, 燃烧, 缠绕)
-                2. 不要把风格和情绪全塞进 Subject！
-                
-                【输出格式】
-                请直接返回纯 JSON 数据，不要包含 ```json 代码块标记。格式如下：
-                {{
-                    "Subject": ["词1", "词2"],
-                    "Action": ["词1"],
-                    "Mood": ["词1"],
-                    "StyleSystem": ["词1"],
-                    "Usage": ["词1"]
-                }}
-                
-                可用Key: Subject, Action, Mood, Usage, StyleSystem, Technique, Color, Texture, Composition, Accent
+                merged, info = analyze_text(client, st.session_state.input_text, st.session_state.db_all, parse_mode)
 
-                输入文本：{st.session_state.input_text}
-                """
-                
-                try:
-                    res_obj = client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=0.1
-                    )
-                    res = res_obj.choices[0].message.content
-                    
-                    parsed = []
-                    
-                    # --- JSON 解析逻辑 ---
-                    try:
-                        clean_json = res.replace("```json", "").replace("```", "").strip()
-                        data = json.loads(clean_json)
-                        
-                        for cat, words in data.items():
-                            target_key = None
-                            for k in WAREHOUSE:
-                                if k.lower() == cat.lower() or k.lower() in cat.lower():
-                                    target_key = k
-                                    break
-                            
-                            if target_key and isinstance(words, list):
-                                for w in words:
-                                    if w and isinstance(w, str):
-                                        parsed.append({"cat": target_key, "val": w.strip()})
-                                        
-                    except json.JSONDecodeError:
-                        st.error("AI 返回格式异常，尝试备用解析...")
-                        # 简单的备用解析逻辑可以加在这里
-                    
-                    st.session_state.ai_results = parsed
+            if isinstance(info["error"], json.JSONDecodeError):
+                st.error("AI 返回格式异常，尝试备用解析...")
+            elif info["error"]:
+                st.error(f"API Request Error: {info['error']}")
+            elif info["source"] == "cache":
+                st.toast("⚡ 命中缓存，未消耗 API", icon="💾")
+            elif info["source"] == "known" and merged:
+                st.toast("⚡ 全部是已知词，未消耗 API", icon="📚")
+            st.session_state.ai_results = merged
+
+    # --- 批量解析 (Bulk Ingest) ---
+    with st.expander("📦 Bulk Ingest (CSV / JSON / JSONL / TXT)"):
+        bulk_file = st.file_uploader("Bulk File", type=["csv", "jsonl", "json", "txt"], key="bulk_file", label_visibility="collapsed")
+        b_c1, b_c2 = st.columns(2)
+        with b_c1:
+            bulk_workers = st.slider("Concurrency", 1, 16, 4)
+        with b_c2:
+            bulk_rate = st.number_input("Requests / sec", 0.1, 20.0, 2.0, step=0.5)
+        # 上面是这次运行的上限；在它之下，速率和实际并发由共享调度器按 429 / 延迟自动调整
+        sched = get_scheduler().snapshot()
+        st.caption(
+            f"⚙️ Scheduler: {sched['rate']} req/s · limit {sched['concurrency_limit']} · "
+            f"{sched['in_flight']} in flight · {sched['retries']} retries · {sched['throttled']} × 429"
+        )
+
+        if st.button("🚀 Analyze All", use_container_width=True, disabled=bulk_file is None):
+            entries = read_bulk_entries(bulk_file.name, bulk_file.getvalue())
+            if not entries:
+                st.warning("No entries found.")
+            elif parse_mode != "Offline" and not client:
+                st.error("DeepSeek API Key not found in .streamlit/secrets.toml")
+            else:
+                rows = []
+                errors = 0
+                progress = st.progress(0.0, text=f"0 / {len(entries)}")
+                table_ph = st.empty()
+                for done, (idx, items, info) in enumerate(
+                    bulk_analyze(client, entries, st.session_state.db_all, parse_mode, bulk_workers, bulk_rate), start=1
+                ):
+                    if info["error"]:
+                        errors += 1
+                    for item in items:
+                        rows.append({"Import": True, "Entry": idx + 1, "Category": item["cat"], "Value": item["val"]})
+                    # 结果边到边显示
+                    progress.progress(done / len(entries), text=f"{done} / {len(entries)} · {errors} errors")
+                    table_ph.dataframe(pd.DataFrame(rows[-200:]), use_container_width=True, hide_index=True)
+                st.session_state.bulk_results = rows
+                st.rerun()
+
+        if st.session_state.get("bulk_results"):
+            edited = st.data_editor(
+                pd.DataFrame(st.session_state.bulk_results).drop_duplicates(subset=["Category", "Value"]),
+                use_container_width=True, hide_index=True, key="bulk_editor",
+                disabled=["Entry", "Category", "Value"]
+            )
+            if st.button("📥 Import Selected (Batched)", use_container_width=True):
+                # 按分类分组，一次写入 + 一次同步
+                grouped = {}
+                for row in edited[edited["Import"]].itertuples():
+                    grouped.setdefault(row.Category, []).append(row.Value)
+                changed_cats = [c for c, vals in grouped.items() if add_words(c, vals)]
+                if changed_cats:
+                    sync_categories_to_github(changed_cats)
+                st.toast(f"✅ Imported into {len(changed_cats)} categories", icon="🎉")
+                st.session_state.bulk_results = []
+                st.rerun()
 
-                except Exception as e:
-                    st.error(f"API Request Error: {e}")
+    # 缓存命中统计 (运维观察用)
+    cache_info = get_ingest_cache().snapshot()
+    st.caption(
+        f"Cache: {cache_info['memory_hits'] + cache_info['disk_hits']} hits / "
+        f"{cache_info['misses']} misses ({cache_info['hit_rate']:.0%}) · "
+        f"{cache_info['entries']} entries · {cache_info['bytes'] / 1024:.0f} KB"
+    )
 
     # --- AI 结果交互区 ---
     if st.session_state.ai_results:
@@ -243,23 +187,20 @@ with col_ingest:
             else:
                 changed_cats = set()
                 count = 0
+                # 按分类分组，每个分类只写一次
+                grouped = {}
                 for item in selected_to_import:
-                    cat, val = item["cat"], item["val"]
-                    # 确保 list 存在
-                    if cat not in st.session_state.db_all:
-                        st.session_state.db_all[cat] = []
-                        
-                    current_list = st.session_state.db_all[cat]
-                    if val not in current_list:
-                        current_list.append(val)
-                        st.session_state.db_all[cat] = current_list
+                    grouped.setdefault(item["cat"], []).append(item["val"])
+
+                for cat, vals in grouped.items():
+                    added = add_words(cat, vals)
+                    if added:
                         changed_cats.add(cat)
-                        count += 1
+                        count += len(added)
                 
-                # 🔥 批量写入硬盘 🔥
+                # 🔥 批量同步：所有分类一个 commit 🔥
                 if changed_cats:
-                    for c in changed_cats:
-                        save_category_to_disk(c, st.session_state.db_all[c])
+                    sync_categories_to_github(changed_cats)
                     
                     st.toast(f"✅ Imported {count} items to Warehouse!", icon="🎉")
                     st.session_state.ai_results = [] # 清空结果
@@ -277,7 +218,7 @@ with col_warehouse:
     c_tools_1, c_tools_2 = st.columns([2, 1])
     with c_tools_1:
         # 只显示列表类型的 Key
-        valid_cats = [k for k, v in st.session_state.db_all.items() if isinstance(v, list)]
+        valid_cats = [k for k in st.session_state.db_all if k in WAREHOUSE]
         target_cat = st.selectbox("Category", valid_cats, label_visibility="collapsed")
     with c_tools_2:
         current_words = st.session_state.db_all.get(target_cat, [])
@@ -298,11 +239,10 @@ with col_warehouse:
                 with row_c2:
                     # 🔥 删除功能：强制写盘 🔥
                     if st.button("✕", key=f"del_{target_cat}_{i}_{word}", use_container_width=True):
-                        new_list = [w for w in current_words if w != word]
-                        st.session_state.db_all[target_cat] = new_list
-                        
+                        remove_words(target_cat, [word])
+
                         # 立即写入
-                        save_category_to_disk(target_cat, new_list)
+                        sync_categories_to_github([target_cat])
                         st.rerun()
 
     # 底部手动添加
@@ -313,12 +253,9 @@ with col_warehouse:
     with c_add2:
         if st.button("Add", use_container_width=True):
             if new_word_in and target_cat:
-                if new_word_in not in current_words:
-                    current_words.append(new_word_in)
-                    st.session_state.db_all[target_cat] = current_words
-                    
+                if add_words(target_cat, [new_word_in]):
                     # 🔥 添加功能：强制写盘 🔥
-                    save_category_to_disk(target_cat, current_words)
+                    sync_categories_to_github([target_cat])
                     
                     st.success(f"Added: {new_word_in}")
                     st.rerun()
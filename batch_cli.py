@@ -0,0 +1,219 @@
+"""
+无界面批量生成 (不经过 Streamlit，结果逐行写入 JSONL，可断点续跑)
+
+    python batch_cli.py graphic --count 5000 --idea 狐狸 --workers 16 --out graphic.jsonl
+    python batch_cli.py text --count 20000 --bank text_en.txt --images all --out text.jsonl
+    python batch_cli.py text --count 100000 --images all --pairs unique --out unique.jsonl
+    python batch_cli.py text --count 500 --images all --look "Line art" --match-ar --out lineart.jsonl
+
+加 --resume 会跳过文件里已经成功的编号，只补缺失和失败的方案 (同一编号以最后一行为准)。
+DeepSeek Key 从环境变量 DEEPSEEK_KEY 读取，DEEPSEEK_BASE_URL 可指向 stub_server.py；
+没有 Key 时 graphic 输出离线占位文案。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from ai_manager import DEFAULT_BASE_URL, get_client
+from engine_manager import WAREHOUSE
+from feature_manager import LOOKS, get_feature_table
+from image_manager import get_image_manifest
+from novelty_manager import get_novelty_filter
+from polish_manager import error_solution, iter_polish_events, offline_solution
+from skeleton_manager import get_sampler
+from text_manager import PAIR_MODES, PLACEHOLDER_WORDS, iter_text_prompts, load_text_bank
+from warehouse_manager import load_warehouse
+
+
+# ==========================================
+# 1. JSONL 输出 (即是结果，也是断点)
+# ==========================================
+class JsonlSink:
+    """每条结果一行、写完立即 flush；续跑时从已有文件里读出完成的编号"""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = self._scan() if resume else set()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+        self.written = 0
+
+    def _scan(self):
+        """成功的编号集合；上次中断留下的半行直接截掉"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return set()
+        if data and not data.endswith(b"\n"):
+            data = data[:data.rfind(b"\n") + 1]
+            with open(self.path, "r+b") as f:
+                f.truncate(len(data))
+
+        done = set()
+        for line in data.decode("utf-8").splitlines():
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("error"):
+                done.discard(rec.get("n"))
+            else:
+                done.add(rec.get("n"))
+        return done
+
+    def write(self, rec):
+        self.file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.written += 1
+
+    def close(self):
+        self.file.close()
+
+
+def report(sink, total, started):
+    elapsed = time.monotonic() - started
+    done = len(sink.done) + sink.written
+    rate = sink.written / elapsed if elapsed > 0 else 0.0
+    print(f"\r{done}/{total}  {rate:.1f}/s", end="", file=sys.stderr, flush=True)
+
+
+# ==========================================
+# 2. Graphic Lab：骨架抽样 + AI 润色
+# ==========================================
+def make_client(args):
+    api_key = os.environ.get("DEEPSEEK_KEY")
+    if args.offline or not api_key:
+        return None
+    return get_client(api_key, os.environ.get("DEEPSEEK_BASE_URL", DEFAULT_BASE_URL))
+
+
+def run_graphic(args, sink):
+    sampler = get_sampler(load_warehouse(WAREHOUSE))
+    novelty = get_novelty_filter()
+    client = make_client(args)
+    todo = [n for n in range(1, args.count + 1) if n not in sink.done]
+    # 一轮抽的骨架数：够所有并发通道各跑几趟，又不会在内存里堆太多
+    chunk = args.chunk or args.workers * args.batch_size * 4
+    started = time.monotonic()
+
+    for start in range(0, len(todo), chunk):
+        numbers = todo[start:start + chunk]
+        batch = sampler.render(sampler.draw_novel(len(numbers), novelty, args.idea), args.idea)
+        if client is None:
+            for n, (sk, subjects) in zip(numbers, batch):
+                sink.write({"n": n, "skeleton": sk, "subjects": subjects, "solution": offline_solution(n, sk)})
+        else:
+            skeletons = [sk for sk, _ in batch]
+            events = iter_polish_events(client, skeletons, max_workers=args.workers,
+                                        batch_size=args.batch_size, numbers=numbers)
+            for kind, i, payload in events:
+                if kind == "delta":
+                    continue
+                rec = {"n": numbers[i], "skeleton": skeletons[i], "subjects": batch[i][1]}
+                if kind == "done":
+                    rec["solution"] = payload
+                else:
+                    rec["solution"] = error_solution(numbers[i], skeletons[i], payload)
+                    rec["error"] = str(payload)
+                sink.write(rec)
+                report(sink, args.count, started)
+        report(sink, args.count, started)
+    novelty.flush()
+
+
+# ==========================================
+# 3. Text Studio：词 + 参考图 -> Prompt
+# ==========================================
+def list_images(spec, look=""):
+    """"all" = images/ 下全部图片；否则是逗号分隔的文件名；空 = 不带图。look 按特征表再筛一遍"""
+    if not spec:
+        return []
+    if spec == "all":
+        images = sorted(get_image_manifest().refresh())
+    else:
+        images = [f.strip() for f in spec.split(",") if f.strip()]
+    return get_feature_table().filter(images, look) if look else images
+
+
+def wait_for_features():
+    """命令行里没有下一次 rerun，缺的特征当场算完"""
+    table = get_feature_table()
+    table.sync()
+    while table.snapshot()["pending"]:
+        time.sleep(0.2)
+    return table
+
+
+def run_text(args, sink):
+    if args.word:
+        pool = [args.word]
+    else:
+        try:
+            bank = load_text_bank()
+        except FileNotFoundError as e:
+            raise SystemExit(f"找不到词库目录 {e}")
+        if args.bank not in bank:
+            raise SystemExit(f"找不到词库 {args.bank}，可选：{', '.join(sorted(bank))}")
+        pool = [w for w in bank[args.bank] if w not in PLACEHOLDER_WORDS] or ["LOVE"]
+    if args.look or args.match_ar:
+        wait_for_features()
+    images = list_images(args.images, args.look)
+    if args.images and not images:
+        raise SystemExit("没有符合条件的参考图")
+    ratios = {img: (get_feature_table().get(img) or {}).get("ar") for img in images} if args.match_ar else {}
+    rng = np.random.default_rng(args.seed)
+    # unique / cartesian 最多只有 词数 × 图数 种组合
+    total = args.count if args.pairs == "replace" else min(args.count, len(pool) * max(len(images), 1))
+    started = time.monotonic()
+
+    # 不管是否跳过都照常抽，保证同一个 seed 续跑结果与一次跑完一致
+    for rows in iter_text_prompts(pool, images, args.count, args.pairs, rng, ars=ratios):
+        for n, word, img_val, prompt_text in rows:
+            if n not in sink.done:
+                sink.write({"n": n, "word": word, "image_file": img_val, "prompt_text": prompt_text})
+        report(sink, total, started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch generation to JSONL")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--count", type=int, required=True, help="方案总数")
+    common.add_argument("--out", required=True, help="输出的 JSONL 文件")
+    common.add_argument("--resume", action="store_true", help="从已有输出续跑")
+
+    g = sub.add_parser("graphic", parents=[common], help="Graphic Lab 骨架 + 润色")
+    g.add_argument("--idea", default="", help="核心词 (留空即盲盒)")
+    g.add_argument("--workers", type=int, default=8, help="同时在飞的请求数")
+    g.add_argument("--batch-size", type=int, default=1, help="每个请求合并的骨架数")
+    g.add_argument("--chunk", type=int, default=0, help="每轮抽样的骨架数 (默认按并发自动算)")
+    g.add_argument("--offline", action="store_true", help="不调 AI，只输出骨架")
+
+    t = sub.add_parser("text", parents=[common], help="Text Studio Prompt")
+    t.add_argument("--bank", default="text_en.txt", help="data/text 下的词库文件名")
+    t.add_argument("--word", default="", help="固定文字 (优先于词库)")
+    t.add_argument("--images", default="", help='"all" 或逗号分隔的图片文件名')
+    t.add_argument("--look", default="", choices=[""] + list(LOOKS), help="只用这类外观的参考图")
+    t.add_argument("--match-ar", action="store_true", help="按参考图宽高比加 --ar")
+    t.add_argument("--pairs", default="replace", choices=PAIR_MODES,
+                   help="replace = 有放回随机；unique = 词图组合不重复；cartesian = 全部组合")
+    t.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args()
+    sink = JsonlSink(args.out, resume=args.resume)
+    try:
+        (run_graphic if args.mode == "graphic" else run_text)(args, sink)
+    except KeyboardInterrupt:
+        print("\n已中断，加 --resume 可以接着跑", file=sys.stderr)
+    finally:
+        sink.close()
+        print(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from warehouse_manager import CACHE_DIR
+
+# ==========================================
+# 1. Key 生成
+# ==========================================
+def make_cache_key(*parts):
+    """内容寻址 key：任意可 JSON 化的部件 -> sha256"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ==========================================
+# 2. 两级缓存：内存 LRU + 磁盘 SQLite
+# ==========================================
+class ResponseCache:
+    """
+    内存里放最近用过的 max_items 条，磁盘上最多 max_bytes，
+    超过 ttl 秒的条目视为过期；磁盘满了按最久未访问淘汰。
+    """
+
+    def __init__(self, path, max_items=256, max_bytes=20 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()    # key -> (写入时间, value)
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def _remember(self, key, created, value):
+        self.memory[key] = (created, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            hit = self.memory.get(key)
+            if hit and now - hit[0] < self.ttl:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return hit[1]
+            self.memory.pop(key, None)
+
+            row = self.db.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                self.db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+                self.db.commit()
+                self._remember(key, row[1], row[0])
+                self.stats["disk_hits"] += 1
+                return row[0]
+            if row:
+                self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.db.commit()
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            self._remember(key, now, value)
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self.stats["stores"] += 1
+            self._evict_locked(now)
+            self.db.commit()
+
+    def _evict_locked(self, now):
+        cur = self.db.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+        self.stats["evictions"] += max(cur.rowcount, 0)
+
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM cache ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.memory.pop(key, None)
+            total -= size
+            self.stats["evictions"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return dict(self.stats, entries=entries, bytes=size, hit_rate=hits / lookups if lookups else 0.0)
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_response_cache(name, **kwargs):
+    """进程级共享：同名缓存只打开一次 (.cache/<name>.sqlite3)"""
+    with _CACHES_LOCK:
+        if name not in _CACHES:
+            _CACHES[name] = ResponseCache(os.path.join(CACHE_DIR, f"{name}.sqlite3"), **kwargs)
+        return _CACHES[name]
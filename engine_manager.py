@@ -1,5 +1,11 @@
 import streamlit as st
 import os
+import time
+
+from warehouse_manager import load_warehouse, get_category, add_items, remove_items, replace_category
+from sync_manager import get_sync_queue
+from ai_manager import get_client, start_metrics_server, DEFAULT_BASE_URL
+from image_manager import get_image_manifest
 
 # ==========================================
 # 1. 本地仓库映射
@@ -42,34 +48,103 @@ def read_local_file(filepath):
     return []
 
 def init_data():
+    """挂载进程级共享词库 (只读视图)，文件没变化时不会碰硬盘"""
     if "db_all" not in st.session_state:
         st.session_state.db_all = {}
-        
-    for key, path in WAREHOUSE.items():
-        if key not in st.session_state.db_all or not st.session_state.db_all[key]:
-            data = read_local_file(path)
-            st.session_state.db_all[key] = data if data else []
+    st.session_state.db_all.update(load_warehouse(WAREHOUSE))
 
 # ==========================================
 # 3. 数据保存
 # ==========================================
+def add_words(category, values):
+    """向分类追加词条 (自动去重)，返回真正新增的词"""
+    added = add_items(category, WAREHOUSE[category], values)
+    st.session_state.db_all[category] = get_category(category)
+    return added
+
+def remove_words(category, values):
+    """从分类删除词条，返回真正删除的词"""
+    removed = remove_items(category, WAREHOUSE[category], values)
+    st.session_state.db_all[category] = get_category(category)
+    return removed
+
 def save_data(file_key, new_list):
     target_key = None
     for k, v in WAREHOUSE.items():
         if v == file_key:
             target_key = k
             break
-            
-    if target_key:
-        st.session_state.db_all[target_key] = new_list
-    
-    os.makedirs(os.path.dirname(file_key), exist_ok=True)
+
     try:
-        with open(file_key, "w", encoding="utf-8") as f:
-            f.write("\n".join(new_list))
+        if target_key:
+            st.session_state.db_all[target_key] = replace_category(target_key, file_key, new_list)
+        else:
+            os.makedirs(os.path.dirname(file_key), exist_ok=True)
+            with open(file_key, "w", encoding="utf-8") as f:
+                f.write("\n".join(new_list))
     except Exception as e:
         st.error(f"Save failed: {e}")
 
+# ==========================================
+# 3.5 GitHub 后台同步
+# ==========================================
+def get_warehouse_sync():
+    """按 secrets 取得进程级后台同步队列；未配置时返回 None"""
+    try:
+        secrets = st.secrets["general"] if "general" in st.secrets else st.secrets
+        local_repo = secrets.get("LOCAL_SYNC_REPO")
+        if not local_repo and not ("GITHUB_TOKEN" in secrets and "REPO_NAME" in secrets):
+            return None
+        return get_sync_queue(
+            WAREHOUSE,
+            token=secrets.get("GITHUB_TOKEN"),
+            repo_name=secrets.get("REPO_NAME"),
+            branch=secrets.get("BRANCH", "main"),
+            local_repo=local_repo
+        )
+    except Exception:
+        return None
+
+def render_sync_status():
+    queue = get_warehouse_sync()
+    if queue is None:
+        return
+    info = queue.snapshot()
+    labels = {
+        "idle": "☁️ Idle",
+        "pending": f"⏳ Pending ({info['pending']})",
+        "syncing": "🔄 Syncing...",
+        "synced": "✅ Synced",
+        "retrying": f"⚠️ Retrying (#{info['failures']})",
+    }
+    line = f"**Sync:** {labels.get(info['state'], info['state'])}"
+    if info["last_sync"]:
+        line += f"  \n<span style='color:#666; font-size:0.8em;'>Last: {time.strftime('%H:%M:%S', time.localtime(info['last_sync']))}</span>"
+    st.markdown(line, unsafe_allow_html=True)
+    if info["last_error"]:
+        st.caption(info["last_error"])
+
+# ==========================================
+# 3.6 AI 客户端 (进程级共享)
+# ==========================================
+def get_ai_client():
+    """
+    返回共享的 DeepSeek 客户端 (连接池常驻 + 自动埋点)，未配置 Key 返回 None
+    DEEPSEEK_BASE_URL 可指向本地桩服务；配置 METRICS_PORT 时顺带启动指标端点
+    """
+    if "DEEPSEEK_KEY" not in st.secrets:
+        return None
+    if "METRICS_PORT" in st.secrets:
+        # 指标端点起不来不影响 AI 客户端
+        try:
+            start_metrics_server(int(st.secrets["METRICS_PORT"]))
+        except ValueError as e:
+            print(f"Metrics Server Error: {e}")
+    try:
+        return get_client(st.secrets["DEEPSEEK_KEY"], st.secrets.get("DEEPSEEK_BASE_URL", DEFAULT_BASE_URL))
+    except Exception:
+        return None
+
 # ==========================================
 # 4. 侧边栏 (已修复 Logo 路径 & 紧凑布局)
 # ==========================================
@@ -117,27 +192,22 @@ def render_sidebar():
             st.markdown(f"""
             **Mood:** {len(db.get('Mood', []))}  
             **Words:** {len(db.get('Text_English', []))}  
-            **Refs:** {len(db.get('Ref_Images', []))}
+            **Refs:** {len(db.get('Ref_Images', []))}  
+            **Images:** {len(get_image_manifest())}
             """)
 
+        st.markdown("---")
+        render_sync_status()
+
 # ==========================================
 # 5. 图库扫描
 # ==========================================
 def fetch_image_refs_auto():
+    """读图库清单 (目录没变化时不碰硬盘)，按修改时间从新到旧"""
     refs = {}
-    local_img_dir = "images"
-    
-    if os.path.exists(local_img_dir):
-        try:
-            files = os.listdir(local_img_dir)
-            valid_exts = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
-            
-            for file in files:
-                if file.lower().endswith(valid_exts):
-                    key_name = os.path.splitext(file)[0]
-                    refs[f"📂 {key_name}"] = file 
-        except Exception:
-            pass
+    for file in get_image_manifest().names_by_mtime():
+        key_name = os.path.splitext(file)[0]
+        refs[f"📂 {key_name}"] = file
             
     if not refs:
         refs["(No Local Images)"] = ""
@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from image_manager import ContentHashJobs, get_image_manifest, save_json_atomic
+from warehouse_manager import CACHE_DIR
+
+# ==========================================
+# 1. 特征提取 (子进程里跑，只看缩小后的像素)
+# ==========================================
+FEATURE_FILE = os.path.join(CACHE_DIR, "image_features.json")
+FEATURE_VERSION = 1       # 算法改了就 +1，旧表整体作废重算
+
+FEATURE_SIZE = 64         # 长边缩到这么多像素再算
+PALETTE_SIZE = 5
+PALETTE_LEVELS = 16       # 每个通道量化成 16 级，共 4096 个色桶
+
+# 与背景亮度差超过这个值的像素算“有墨”
+INK_DELTA = 0.25
+
+# Midjourney --ar 的候选比例 (宽:高)
+ASPECT_RATIOS = ("1:1", "4:5", "5:4", "3:4", "4:3", "2:3", "3:2", "9:16", "16:9")
+
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def nearest_ratio(width, height):
+    if not width or not height:
+        return "1:1"
+    target = np.log(width / height)
+    logs = [np.log(int(w) / int(h)) for w, h in (r.split(":") for r in ASPECT_RATIOS)]
+    return ASPECT_RATIOS[int(np.argmin(np.abs(np.array(logs) - target)))]
+
+
+def dominant_palette(rgb, k=PALETTE_SIZE, levels=PALETTE_LEVELS):
+    """rgb: (N, 3) 的 0~1 数组 -> [{"hex", "share"}]，按占比从大到小"""
+    q = np.minimum((rgb * levels).astype(np.int32), levels - 1)
+    bins = (q[:, 0] * levels + q[:, 1]) * levels + q[:, 2]
+    counts = np.bincount(bins, minlength=levels ** 3)
+    top = np.argsort(counts)[::-1][:k]
+    top = top[counts[top] > 0]
+    # 每个色桶用桶内像素的平均色，而不是桶中心
+    sums = np.stack([np.bincount(bins, weights=rgb[:, c], minlength=levels ** 3) for c in range(3)], axis=1)
+    means = np.rint(sums[top] / counts[top, None] * 255).astype(int)
+    return [
+        {"hex": "#%02x%02x%02x" % tuple(color), "share": round(float(n) / len(bins), 3)}
+        for color, n in zip(means, counts[top])
+    ]
+
+
+def extract_features(path, size=FEATURE_SIZE):
+    """
+    -> {width, height, aspect, ar, palette, background, ink, contrast, colourfulness}
+    ink: 与背景 (四边亮度中位数) 明显不同的像素占比，深色底浅色线也一样算；
+    contrast: 亮度 5% ~ 95% 分位差；colourfulness: Hasler-Süsstrunk 色彩度 (0~1 量级)
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+        img.draft("RGB", (size * 2, size * 2))
+        img = img.convert("RGBA")
+        img.thumbnail((size, size))
+        px = np.asarray(img, dtype=np.float32) / 255
+
+    # 透明部分按白底合成
+    alpha = px[..., 3:]
+    rgb = px[..., :3] * alpha + (1 - alpha)
+    lum = rgb @ LUMA
+    border = np.concatenate([lum[0], lum[-1], lum[:, 0], lum[:, -1]])
+    background = float(np.median(border))
+    lo, hi = np.percentile(lum, [5, 95])
+
+    rgb = rgb.reshape(-1, 3)
+    rg = rgb[:, 0] - rgb[:, 1]
+    yb = 0.5 * (rgb[:, 0] + rgb[:, 1]) - rgb[:, 2]
+    colourfulness = np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean())
+
+    return {
+        "width": width, "height": height,
+        "aspect": round(width / height, 3) if height else None,
+        "ar": nearest_ratio(width, height),
+        "palette": dominant_palette(rgb),
+        "background": round(background, 3),
+        "ink": round(float((np.abs(lum - background) > INK_DELTA).mean()), 3),
+        "contrast": round(float(hi - lo), 3),
+        "colourfulness": round(float(colourfulness), 3),
+    }
+
+
+# ==========================================
+# 2. 画廊筛选用的“外观”分类
+# ==========================================
+LINE_ART_CONTRAST = 0.6
+LINE_ART_MAX_INK = 0.3
+MONO_MAX_COLOUR = 0.1
+COLOUR_MIN_COLOUR = 0.13
+
+LOOKS = {
+    # 高对比线稿：黑白、亮暗分得开、墨只占小部分
+    "Line art": lambda f: (f["contrast"] >= LINE_ART_CONTRAST and f["ink"] <= LINE_ART_MAX_INK
+                           and f["colourfulness"] < MONO_MAX_COLOUR),
+    "Colour": lambda f: f["colourfulness"] >= COLOUR_MIN_COLOUR,
+    "Black & grey": lambda f: f["colourfulness"] < MONO_MAX_COLOUR,
+}
+
+
+# ==========================================
+# 3. 特征表 (按内容哈希存，随清单增量更新)
+# ==========================================
+class FeatureTable(ContentHashJobs):
+    label = "Feature"
+
+    def __init__(self, path=FEATURE_FILE):
+        super().__init__()
+        self.path = path
+        self.features = {}       # 内容哈希 -> 特征
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == FEATURE_VERSION:
+                self.features = data.get("features", {})
+        except (OSError, ValueError):
+            self.features = {}
+
+    def _has(self, digest):
+        return digest in self.features
+
+    def _job(self, manifest, name, digest):
+        return extract_features, (manifest.file_path(name),)
+
+    def _prune(self, wanted):
+        gone = [d for d in self.features if d not in wanted]
+        for digest in gone:
+            del self.features[digest]
+        if gone:
+            self._flush()
+
+    def _store(self, digest, result):
+        self.features[digest] = result
+
+    def _flush(self):
+        save_json_atomic(self.path, {"version": FEATURE_VERSION, "features": self.features})
+
+    # --- 查询 (输入输出都是文件名，不碰图片文件) ---
+    def get(self, name, manifest=None):
+        """文件名 -> 特征；还没算出来返回 None"""
+        info = (manifest or get_image_manifest()).images.get(name)
+        with self.lock:
+            return self.features.get(info["hash"]) if info else None
+
+    def filter(self, names, look, manifest=None):
+        """names 里符合 LOOKS[look] 的图，保持原顺序；特征还没算出来的图不算符合"""
+        if not look or look not in LOOKS:
+            return list(names)
+        match = LOOKS[look]
+        images = (manifest or get_image_manifest()).images
+        with self.lock:
+            features = self.features
+            return [
+                n for n in names
+                if n in images and images[n]["hash"] in features and match(features[images[n]["hash"]])
+            ]
+
+    def snapshot(self):
+        with self.lock:
+            return dict(super().snapshot(), indexed=len(self.features))
+
+
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def get_feature_table():
+    with _TABLES_LOCK:
+        if "default" not in _TABLES:
+            _TABLES["default"] = FeatureTable()
+        return _TABLES["default"]
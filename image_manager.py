@@ -0,0 +1,422 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, features
+
+from warehouse_manager import BASE_DIR, CACHE_DIR, CHECK_INTERVAL, file_signature
+
+# ==========================================
+# 1. 图库清单 (images/ 下每张图一条记录，落盘在 .cache/)
+# ==========================================
+IMAGE_DIR = os.path.join(BASE_DIR, "images")
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+MANIFEST_FILE = os.path.join(CACHE_DIR, "image_manifest.json")
+
+HASH_CHUNK = 1 << 20
+IMAGE_WORKERS = min(4, os.cpu_count() or 1)
+
+# 画廊筛选结果缓存几组 (不同 Session 的筛选条件各占一组)
+QUERY_CACHE_SIZE = 32
+
+
+def content_hash(path):
+    """文件内容 sha256 (分块读，大图也不占内存)"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_dimensions(path):
+    """只读文件头拿宽高；不是合法图片返回 (None, None)"""
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+
+def describe_image(path, stat):
+    width, height = image_dimensions(path)
+    return {
+        "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "width": width, "height": height, "hash": content_hash(path),
+    }
+
+
+class ImageManifest:
+    """
+    {文件名: {size, mtime_ns, width, height, hash}}。
+    目录 mtime 没变就不扫描；变了才用 os.scandir 走一遍，
+    只有新增或 size / mtime 变了的文件才重新读宽高、算哈希。
+    """
+
+    def __init__(self, image_dir=IMAGE_DIR, path=MANIFEST_FILE):
+        self.image_dir = image_dir
+        self.path = path
+        self.lock = threading.Lock()
+        self.dir_sig = None
+        self.images = {}
+        self.checked = 0.0
+        self.version = 0          # 清单每变一次 +1，派生结果 (排序、索引) 据此判断是否重算
+        self._by_mtime = (None, [])
+        self._queries = OrderedDict()
+        self._by_hash = (None, {})
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("image_dir") == self.image_dir:
+                self.images = data.get("images", {})
+                self.dir_sig = tuple(data["dir_sig"]) if data.get("dir_sig") else None
+        except (OSError, ValueError, KeyError):
+            self.images = {}
+
+    def _save_locked(self):
+        save_json_atomic(self.path, {"image_dir": self.image_dir, "dir_sig": self.dir_sig, "images": self.images},
+                         ensure_ascii=False)
+
+    def _scan_locked(self):
+        images = {}
+        changed = False
+        try:
+            entries = list(os.scandir(self.image_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.name.lower().endswith(IMAGE_EXTS) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            old = self.images.get(entry.name)
+            if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+                images[entry.name] = old
+                continue
+            try:
+                images[entry.name] = describe_image(entry.path, stat)
+                changed = True
+            except OSError:
+                continue
+        changed = changed or images.keys() != self.images.keys()
+        self.images = images
+        return changed
+
+    def refresh(self, force=False):
+        """最多每 CHECK_INTERVAL 秒 stat 一次目录；force 时无视目录 mtime 整体重扫"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.checked < CHECK_INTERVAL:
+                return self.images
+            self.checked = now
+            dir_sig = file_signature(self.image_dir)
+            if not force and dir_sig == self.dir_sig:
+                return self.images
+            changed = self._scan_locked()
+            self.dir_sig = dir_sig
+            if changed:
+                self.version += 1
+            self._save_locked()
+            return self.images
+
+    def names_by_mtime(self):
+        """按修改时间从新到旧的文件名列表 (清单没变时复用同一个列表)"""
+        images = self.refresh()
+        with self.lock:
+            if self._by_mtime[0] != self.version:
+                names = sorted(images, key=lambda n: images[n]["mtime_ns"], reverse=True)
+                self._by_mtime = (self.version, names)
+            return self._by_mtime[1]
+
+    def query(self, name="", since_ns=None, until_ns=None):
+        """
+        按文件名子串 (忽略大小写) 和修改时间区间筛选 -> (按时间从新到旧的列表, 集合)。
+        同样的条件在清单没变时直接复用上次结果
+        """
+        names = self.names_by_mtime()
+        needle = name.strip().casefold()
+        with self.lock:
+            key = (self.version, needle, since_ns, until_ns)
+            if key in self._queries:
+                self._queries.move_to_end(key)
+                return self._queries[key]
+            images = self.images
+            hits = [
+                n for n in names
+                if (not needle or needle in n.casefold())
+                and (since_ns is None or images[n]["mtime_ns"] >= since_ns)
+                and (until_ns is None or images[n]["mtime_ns"] < until_ns)
+            ] if (needle or since_ns is not None or until_ns is not None) else names
+            self._queries[key] = (hits, frozenset(hits))
+            while len(self._queries) > QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
+            return self._queries[key]
+
+    def name_for_hash(self, digest):
+        """内容哈希 -> 图库里的文件名 (没有返回 None)"""
+        self.refresh()
+        with self.lock:
+            if self._by_hash[0] != self.version:
+                index = {}
+                for name, info in self.images.items():
+                    index.setdefault(info["hash"], name)
+                self._by_hash = (self.version, index)
+            return self._by_hash[1].get(digest)
+
+    def get(self, name):
+        return self.refresh().get(name)
+
+    def __contains__(self, name):
+        return name in self.refresh()
+
+    def __len__(self):
+        return len(self.refresh())
+
+    def file_path(self, name):
+        return os.path.join(self.image_dir, name)
+
+
+_MANIFESTS = {}
+_MANIFESTS_LOCK = threading.Lock()
+_POOL = {}
+
+
+def get_image_manifest(image_dir=IMAGE_DIR):
+    """进程级共享，所有页面 / Session 读同一份清单"""
+    with _MANIFESTS_LOCK:
+        if image_dir not in _MANIFESTS:
+            _MANIFESTS[image_dir] = ImageManifest(image_dir)
+        return _MANIFESTS[image_dir]
+
+
+def get_process_pool():
+    """图片相关的 CPU 活 (缩略图、压缩、特征) 共用一个进程池"""
+    with _MANIFESTS_LOCK:
+        if "pool" not in _POOL:
+            # spawn：Streamlit 进程里有很多线程，fork 出来的子进程可能继承到被锁住的锁
+            _POOL["pool"] = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _POOL["pool"]
+
+
+def reset_process_pool(broken):
+    """子进程被杀 (比如大图 OOM) 后池子就永久不可用了；丢掉它，下次 get_process_pool() 建新的"""
+    with _MANIFESTS_LOCK:
+        if _POOL.get("pool") is broken:
+            del _POOL["pool"]
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _reset_if_broken(pool, future):
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        reset_process_pool(pool)
+
+
+def submit_image_job(fn, *args):
+    """提交到共享进程池；池已损坏时换一个新池重试一次。任务因池崩溃失败时也会换池"""
+    pool = get_process_pool()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        reset_process_pool(pool)
+        pool = get_process_pool()
+        future = pool.submit(fn, *args)
+    future.add_done_callback(lambda f: _reset_if_broken(pool, f))
+    return future
+
+
+def save_json_atomic(path, data, **kwargs):
+    """先写临时文件再改名，读的一方永远看不到半截 JSON"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
+
+# ==========================================
+# 2. 按内容哈希的后台任务表 (缩略图 / 感知哈希 / 特征共用)
+# ==========================================
+# 同一张图的任务因为进程池崩溃失败几次后就不再重试 (多半是它自己把子进程撑爆了)
+JOB_MAX_ATTEMPTS = 3
+
+
+class ContentHashJobs(ABC):
+    """
+    清单里每个内容哈希在进程池里跑一次任务 (同一张图换名字 / 重复上传只跑一次)。
+    sync() 在清单变化时提交缺的任务、清掉原图已删除的结果；子类必须实现前两个，其余可选：
+        _has(digest)                   结果是否已经有了
+        _job(manifest, name, digest)   -> (函数, 参数元组)，在子进程里执行
+        _prune(wanted)                 清掉不在 wanted 里的结果 (锁内调用)
+        _store(digest, result)         收下一个结果 (锁内调用)
+        _flush()                       一轮任务全部完成后落盘 (锁内调用)
+    """
+
+    label = "Image Job"
+
+    def __init__(self):
+        self.lock = threading.RLock()   # 已完成的 future 会在 add_done_callback 里同步回调 _done
+        self.pending = set()
+        self.attempts = {}              # 内容哈希 -> 因进程池崩溃失败的次数
+        self.synced_version = None
+
+    @abstractmethod
+    def _has(self, digest):
+        pass
+
+    @abstractmethod
+    def _job(self, manifest, name, digest):
+        pass
+
+    def _prune(self, wanted):
+        pass
+
+    def _store(self, digest, result):
+        pass
+
+    def _flush(self):
+        pass
+
+    def _done(self, digest, future):
+        with self.lock:
+            self.pending.discard(digest)
+            if future.cancelled():
+                self.synced_version = None
+                return
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                # 池子坏了 (submit_image_job 会换新池)：下次 sync 重新提交，同一张图反复失败就放弃
+                print(f"{self.label} Error: {error}")
+                self.attempts[digest] = self.attempts.get(digest, 0) + 1
+                self.synced_version = None
+                return
+            if error is not None:
+                print(f"{self.label} Error: {error}")
+                return
+            self._store(digest, future.result())
+            if not self.pending:
+                self._flush()
+
+    def sync(self, manifest=None):
+        """清单版本没变时什么都不做；任务全部提交成功才记下这个版本"""
+        manifest = manifest or get_image_manifest()
+        images = manifest.refresh()
+        with self.lock:
+            if self.synced_version == manifest.version:
+                return
+            wanted = {}
+            for name, info in images.items():
+                wanted.setdefault(info["hash"], name)
+            self._prune(wanted)
+
+            for digest, name in wanted.items():
+                if digest in self.pending or self._has(digest):
+                    continue
+                if self.attempts.get(digest, 0) >= JOB_MAX_ATTEMPTS:
+                    continue
+                fn, args = self._job(manifest, name, digest)
+                try:
+                    future = submit_image_job(fn, *args)
+                except (BrokenProcessPool, RuntimeError) as e:
+                    # 这次提交不上就下次 rerun 再来，不影响页面
+                    print(f"{self.label} Error: {e}")
+                    return
+                self.pending.add(digest)
+                future.add_done_callback(lambda f, d=digest: self._done(d, f))
+            self.synced_version = manifest.version
+
+    def snapshot(self):
+        with self.lock:
+            return {"pending": len(self.pending)}
+
+
+# ==========================================
+# 3. 缩略图 (按内容哈希存，进程池后台生成)
+# ==========================================
+THUMB_DIR = os.path.join(CACHE_DIR, "thumbs")
+THUMB_SIZE = 384          # 长边像素，5 列网格下足够清晰
+THUMB_QUALITY = 80
+THUMB_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+THUMB_EXT = ".webp" if THUMB_FORMAT == "WEBP" else ".jpg"
+
+
+def make_thumbnail(src, dst, size=THUMB_SIZE, fmt=THUMB_FORMAT, quality=THUMB_QUALITY):
+    """在子进程里跑：缩放后先写临时文件再改名，半截文件永远不会被页面读到"""
+    with Image.open(src) as img:
+        img.draft("RGB", (size, size))   # JPEG 直接按缩小比例解码
+        img.thumbnail((size, size))
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        tmp_path = dst + ".tmp"
+        img.save(tmp_path, fmt, quality=quality)
+    os.replace(tmp_path, dst)
+    return dst
+
+
+class ThumbnailCache(ContentHashJobs):
+    """
+    清单里每个内容哈希对应一张缩略图 (同一张图换名字 / 重复上传共用一张)。
+    原图已删除的缩略图在 sync() 时清掉；生成完成前 path_for() 返回 None，页面先用原图顶上。
+    """
+
+    label = "Thumbnail"
+
+    def __init__(self, thumb_dir=THUMB_DIR):
+        super().__init__()
+        self.thumb_dir = thumb_dir
+
+    def _path(self, digest):
+        return os.path.join(self.thumb_dir, digest + THUMB_EXT)
+
+    def _has(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def _job(self, manifest, name, digest):
+        return make_thumbnail, (manifest.file_path(name), self._path(digest))
+
+    def _prune(self, wanted):
+        # 原图已经不在清单里的缩略图直接删掉
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        for entry in os.scandir(self.thumb_dir):
+            digest = entry.name.split(".", 1)[0]
+            if digest not in wanted and digest not in self.pending:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def path_for(self, info):
+        """info 是清单记录；缩略图已生成返回路径，否则 None"""
+        if not info:
+            return None
+        path = self._path(info["hash"])
+        with self.lock:
+            if info["hash"] in self.pending:
+                return None
+        return path if os.path.exists(path) else None
+
+
+_THUMBS = {}
+
+
+def get_thumbnail_cache():
+    with _MANIFESTS_LOCK:
+        if "default" not in _THUMBS:
+            _THUMBS["default"] = ThumbnailCache()
+        return _THUMBS["default"]
+
+
+def display_path(manifest, name):
+    """网格里显示用：有缩略图用缩略图，没有 (还在生成) 用原图"""
+    thumb = get_thumbnail_cache().path_for(manifest.images.get(name))
+    return thumb or manifest.file_path(name)
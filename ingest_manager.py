@@ -0,0 +1,432 @@
+import csv
+import io
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cache_manager import get_response_cache, make_cache_key
+from warehouse_manager import normalize_key
+
+# ==========================================
+# 1. Smart Ingest Prompt
+# ==========================================
+INGEST_MODEL = "deepseek-chat"
+
+# 改了 Prompt 就把版本号加一，旧缓存自动失效
+PROMPT_VERSION = "ingest-v1"
+
+
+def build_ingest_prompt(text):
+    return f"""
+                任务：将纹身描述文本拆解为结构化关键词。
+
+                【重要规则】
+                1. 请务必区分：
+                   - Subject (主体): 具体的物体、生物 (如: 猫, 骷髅, 玫瑰)
+                   - StyleSystem (风格): 艺术流派 (如: 赛博朋克, Old School, 水墨)
+                   - Mood (情绪): 氛围感受 (如: 压抑, 欢快, 神圣)
+                   - Action (动作): 动态 (如: 奔跑, 燃烧, 缠绕)
+                2. 不要把风格和情绪全塞进 Subject！
+
+                【输出格式】
+                请直接返回纯 JSON 数据，不要包含 ```json 代码块标记。格式如下：
+                {{
+                    "Subject": ["词1", "词2"],
+                    "Action": ["词1"],
+                    "Mood": ["词1"],
+                    "StyleSystem": ["词1"],
+                    "Usage": ["词1"]
+                }}
+
+                可用Key: Subject, Action, Mood, Usage, StyleSystem, Technique, Color, Texture, Composition, Accent
+
+                输入文本：{text}
+                """
+
+
+def parse_ingest_response(res, categories):
+    """
+    AI 返回的 JSON -> [{"cat", "val"}]
+    格式异常时抛出 json.JSONDecodeError
+    """
+    clean_json = res.replace("```json", "").replace("```", "").strip()
+    data = json.loads(clean_json)
+
+    parsed = []
+    for cat, words in data.items():
+        target_key = None
+        for k in categories:
+            if k.lower() == cat.lower() or k.lower() in cat.lower():
+                target_key = k
+                break
+
+        if target_key and isinstance(words, list):
+            for w in words:
+                if w and isinstance(w, str):
+                    parsed.append({"cat": target_key, "val": w.strip()})
+    return parsed
+
+
+# ==========================================
+# 2. 带缓存的解析
+# ==========================================
+def get_ingest_cache():
+    return get_response_cache("ingest_cache")
+
+
+def ingest_cache_key(text, model=INGEST_MODEL):
+    return make_cache_key(PROMPT_VERSION, model, normalize_key(text))
+
+
+def request_ingest(client, text, model=INGEST_MODEL):
+    """
+    返回 (原始回复, 是否命中缓存)
+    相同 (归一化后) 的输入 + Prompt 版本 + 模型 只会花一次 API 钱
+    """
+    cache = get_ingest_cache()
+    key = ingest_cache_key(text, model)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    res_obj = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": build_ingest_prompt(text)}],
+        temperature=0.1
+    )
+    res = res_obj.choices[0].message.content
+    return res, False
+
+
+def remember_ingest(text, res, model=INGEST_MODEL):
+    """只缓存能正常解析的回复，避免把坏结果钉在缓存里"""
+    get_ingest_cache().put(ingest_cache_key(text, model), res)
+
+
+# ==========================================
+# 3. 本地词典预分类 (Aho-Corasick 多模式匹配)
+# ==========================================
+def _fold_char(ch):
+    """逐字符归一化 (全角转半角 + 忽略大小写)，保证下标和原文一一对应"""
+    folded = unicodedata.normalize("NFKC", ch).casefold()
+    return folded if len(folded) == 1 else ch.lower()
+
+
+def _fold_text(text):
+    return "".join(_fold_char(ch) for ch in text)
+
+
+def _is_word_char(ch):
+    return ch.isascii() and ch.isalnum()
+
+
+class _Node:
+    __slots__ = ("goto", "fail", "terms", "dict_link")
+
+    def __init__(self):
+        self.goto = {}
+        self.fail = None
+        self.terms = set()        # 以该节点结尾的归一化词
+        self.dict_link = None     # 沿 fail 链最近的一个有词的节点
+
+
+class TermMatcher:
+    """
+    用仓库里所有分类的词建一个 Aho-Corasick 自动机，一遍扫描找出文本里所有已知词。
+    中文不需要分词；纯英文/数字词要求两侧不是字母数字，避免 cat 命中 category。
+    仓库变化时按分类做增量更新：删词只摘掉节点上的标记，加词只插入新路径，
+    失配指针在下一次查询前统一重算 (不会重建整棵 trie)。
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.term_cats = {}       # 归一化词 -> {分类: 原词}
+        self.cat_terms = {}       # 分类 -> {归一化词}
+        self.versions = {}        # 分类 -> (分类对象, version)
+        self.links_dirty = True
+        self.lock = threading.Lock()
+
+    # --- 构建 / 增量更新 ---
+    def _insert(self, term):
+        node = self.root
+        for ch in term:
+            node = node.goto.setdefault(ch, _Node())
+        if term not in node.terms:
+            node.terms.add(term)
+            self.links_dirty = True
+
+    def _remove(self, term):
+        node = self.root
+        for ch in term:
+            node = node.goto.get(ch)
+            if node is None:
+                return
+        node.terms.discard(term)
+        # 节点留在 trie 里，没有词标记就不会产出结果
+
+    def _build_links(self):
+        queue = deque()
+        for child in self.root.goto.values():
+            child.fail = self.root
+            child.dict_link = None
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in node.goto.items():
+                fail = node.fail
+                while fail is not None and ch not in fail.goto:
+                    fail = fail.fail
+                child.fail = fail.goto[ch] if fail is not None else self.root
+                child.dict_link = child.fail if child.fail.terms else child.fail.dict_link
+                queue.append(child)
+        self.links_dirty = False
+
+    def sync(self, db):
+        """让自动机与仓库保持一致，只处理 version 变化过的分类"""
+        with self.lock:
+            for cat, items in db.items():
+                # 存对象本身并用 is 比较：重新加载后的新分类哪怕 id 和 version 都撞上也会重建
+                version = getattr(items, "version", None)
+                prev = self.versions.get(cat)
+                if prev and prev[0] is items and prev[1] == version and version is not None:
+                    continue
+                wanted = {_fold_text(str(w).strip()): str(w).strip() for w in items if str(w).strip()}
+                old = self.cat_terms.get(cat, set())
+                for term in old - wanted.keys():
+                    cats = self.term_cats.get(term, {})
+                    cats.pop(cat, None)
+                    if not cats:
+                        self.term_cats.pop(term, None)
+                        self._remove(term)
+                for term, original in wanted.items():
+                    self.term_cats.setdefault(term, {})[cat] = original
+                    if term not in old:
+                        self._insert(term)
+                self.cat_terms[cat] = set(wanted)
+                self.versions[cat] = (items, version)
+            if self.links_dirty:
+                self._build_links()
+
+    # --- 查询 ---
+    def find_all(self, text):
+        """返回所有命中 [(start, end, 归一化词)]，可能互相重叠"""
+        folded = _fold_text(text)
+        hits = []
+        node = self.root
+        for i, ch in enumerate(folded):
+            while node is not self.root and ch not in node.goto:
+                node = node.fail
+            node = node.goto.get(ch, self.root)
+            out = node if node.terms else node.dict_link
+            while out is not None:
+                for term in out.terms:
+                    start = i + 1 - len(term)
+                    if _is_word_char(term[0]) and start > 0 and _is_word_char(folded[start - 1]):
+                        continue
+                    if _is_word_char(term[-1]) and i + 1 < len(folded) and _is_word_char(folded[i + 1]):
+                        continue
+                    hits.append((start, i + 1, term))
+                out = out.dict_link
+        return hits
+
+    def match(self, text):
+        """
+        最长优先、互不重叠的命中 -> [{"cat", "val", "start", "end"}]
+        同一个词属于多个分类时每个分类各出一条
+        """
+        with self.lock:
+            hits = sorted(self.find_all(text), key=lambda h: (h[0], -(h[1] - h[0])))
+            results = []
+            cursor = 0
+            for start, end, term in hits:
+                if start < cursor:
+                    continue
+                for cat, original in self.term_cats.get(term, {}).items():
+                    results.append({"cat": cat, "val": original, "start": start, "end": end})
+                cursor = end
+            return results
+
+
+# 词与词之间的分隔：空白和常见中英文标点
+_SEPARATORS = re.compile(r"[\s,，.。;；:：!！?？、/|\\()（）\[\]【】{}<>《》\"'“”‘’+\-—_~·…]+")
+
+
+def unknown_spans(text, matches, min_len=2):
+    """去掉已知词后剩下的片段 (只把这些交给 AI)"""
+    covered = [False] * len(text)
+    for m in matches:
+        for i in range(m["start"], m["end"]):
+            covered[i] = True
+    rest = "".join(" " if c else ch for ch, c in zip(text, covered))
+    return [seg for seg in _SEPARATORS.split(rest) if len(seg.strip()) >= min_len]
+
+
+_MATCHER = TermMatcher()
+
+
+def get_term_matcher(db):
+    """进程级共享自动机，按需增量同步到当前仓库"""
+    _MATCHER.sync(db)
+    return _MATCHER
+
+
+# ==========================================
+# 4. 单条解析 (UI 和批量模式共用)
+# ==========================================
+def analyze_text(client, text, db, mode="Hybrid"):
+    """
+    mode: "Hybrid" / "AI Only" / "Offline"
+    返回 (items, info)，info = {"source": "offline"/"known"/"cache"/"api", "error": 异常或 None}
+    出错时仍然返回本地词典识别出的部分
+    """
+    known = []
+    ai_text = text
+    if mode != "AI Only":
+        matches = get_term_matcher(db).match(text)
+        known = [{"cat": m["cat"], "val": m["val"]} for m in matches]
+        ai_text = "，".join(unknown_spans(text, matches))
+
+    parsed = []
+    info = {"source": "offline" if mode == "Offline" else "known", "error": None}
+    if mode != "Offline" and ai_text:
+        try:
+            res, from_cache = request_ingest(client, ai_text)
+            info["source"] = "cache" if from_cache else "api"
+            parsed = parse_ingest_response(res, db.keys())
+            if not from_cache:
+                remember_ingest(ai_text, res)
+        except Exception as e:
+            info["error"] = e
+
+    # 合并去重：已知词在前
+    seen = set()
+    merged = []
+    for item in known + parsed:
+        if (item["cat"], item["val"]) not in seen:
+            seen.add((item["cat"], item["val"]))
+            merged.append(item)
+    return merged, info
+
+
+# ==========================================
+# 5. 批量解析 (并发 + 限速)
+# ==========================================
+TEXT_FIELDS = ("text", "content", "note", "notes", "brief", "description", "内容", "备注")
+
+
+def _pick_text(record):
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        for field in TEXT_FIELDS:
+            if record.get(field):
+                return str(record[field])
+        # 没有约定字段就取最长的字符串列
+        values = [str(v) for v in record.values() if isinstance(v, str)]
+        return max(values, key=len) if values else ""
+    return ""
+
+
+def _json_records(content):
+    """
+    整个 .json 文件：数组直接用；对象取它的第一个数组字段 ({"items": [...]})；
+    单个对象算一条。解析失败返回 None (其实是 JSONL，交给逐行解析)
+    """
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(data, dict):
+        return next((v for v in data.values() if isinstance(v, list)), [data])
+    return data if isinstance(data, list) else [data]
+
+
+def read_bulk_entries(file_name, data):
+    """
+    CSV / JSON / JSONL / 纯文本 -> 文本列表
+    纯文本按空行分段；没有空行时一行一条
+    """
+    try:
+        content = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        content = data.decode("gbk", errors="replace")
+
+    name = file_name.lower()
+    records = _json_records(content) if name.endswith(".json") else None
+    if name.endswith(".csv"):
+        entries = [_pick_text(row) for row in csv.DictReader(io.StringIO(content))]
+    elif records is not None:
+        entries = [_pick_text(r) for r in records]
+    elif name.endswith((".jsonl", ".ndjson", ".json")):
+        entries = []
+        for line in content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(_pick_text(json.loads(line)))
+            except json.JSONDecodeError:
+                entries.append(line)
+    else:
+        blocks = re.split(r"\n\s*\n", content)
+        entries = blocks if len(blocks) > 1 else content.splitlines()
+    return [e.strip() for e in entries if e and e.strip()]
+
+
+class RateLimiter:
+    """简单的匀速限流：两次请求之间至少间隔 1/rate 秒"""
+
+    def __init__(self, rate_per_sec):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self, cancel=None):
+        """等到自己的发送时刻；期间 cancel 被触发返回 False"""
+        if not self.interval:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+        if slot <= now:
+            return True
+        if cancel is not None:
+            return not cancel.wait(slot - now)
+        time.sleep(slot - now)
+        return True
+
+
+def bulk_analyze(client, entries, db, mode="Hybrid", max_workers=4, max_rate=None):
+    """
+    并发解析多条文本，按完成顺序逐条产出 (序号, items, info)
+    线程池只决定最多同时排队多少条；max_rate 是这次运行的速率上限 (条/秒，None 不设)，
+    在它之下真正的请求速率和并发由 scheduler_manager 自适应控制
+    """
+    stop = threading.Event()
+    limiter = RateLimiter(max_rate)
+
+    def work(text):
+        # 调用方已经放弃 (离开页面 / rerun) 就不再发请求
+        if stop.is_set() or not limiter.wait(stop):
+            return [], {"source": "cancelled", "error": None}
+        return analyze_text(client, text, db, mode)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bulk-ingest")
+    try:
+        futures = {pool.submit(work, text): i for i, text in enumerate(entries)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                items, info = future.result()
+            except Exception as e:
+                items, info = [], {"source": "error", "error": e}
+            yield i, items, info
+    finally:
+        # 生成器被关闭时不等排队的条目跑完 (每条都是一次付费请求)
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
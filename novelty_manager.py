@@ -0,0 +1,154 @@
+import atexit
+import hashlib
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from warehouse_manager import CACHE_DIR
+
+# ==========================================
+# 1. 布隆过滤器 (定长位数组，向量化读写)
+# ==========================================
+BLOOM_FILE = os.path.join(CACHE_DIR, "novelty_bloom.npz")
+
+# 每一代能装多少组合；装满就轮换，内存上限 = 两代位数组
+GENERATION_CAPACITY = 1_000_000
+ERROR_RATE = 0.01
+
+# 落盘的最短间隔 (秒)，进程退出时再补存一次
+SAVE_INTERVAL = 30.0
+
+
+def hash_keys(keys):
+    """字符串 -> 两组 64 位哈希 (双重哈希用)"""
+    h1 = np.empty(len(keys), dtype=np.uint64)
+    h2 = np.empty(len(keys), dtype=np.uint64)
+    for i, key in enumerate(keys):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1[i] = int.from_bytes(digest[:8], "little")
+        h2[i] = int.from_bytes(digest[8:], "little") | 1
+    return h1, h2
+
+
+class BloomFilter:
+    def __init__(self, capacity=GENERATION_CAPACITY, error_rate=ERROR_RATE, bits=None, count=0):
+        self.capacity = capacity
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bits if bits is not None else np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+        self.count = count
+
+    def _positions(self, h1, h2):
+        i = np.arange(self.n_hashes, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            return (h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(self.n_bits)
+
+    def contains(self, h1, h2):
+        pos = self._positions(h1, h2)
+        hit = (self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+        return hit.all(axis=1)
+
+    def add(self, h1, h2):
+        pos = self._positions(h1, h2).ravel()
+        np.bitwise_or.at(self.bits, pos >> np.uint64(3), (1 << (pos & np.uint64(7))).astype(np.uint8))
+        self.count += len(h1)
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class RotatingBloom:
+    """
+    两代布隆过滤器：当前代装满后整体降级为上一代，再开一个新的。
+    查询同时看两代，所以最近至少 capacity 个组合一定记得住，内存永远有上限。
+    """
+
+    def __init__(self, path=BLOOM_FILE, capacity=GENERATION_CAPACITY, error_rate=ERROR_RATE):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+        self.stats = {"checked": 0, "rejected": 0, "exhausted": 0}
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self._load()
+
+    def _load(self):
+        try:
+            data = np.load(self.path)
+            if int(data["capacity"]) != self.capacity:
+                return
+            self.current = BloomFilter(self.capacity, self.error_rate, data["current"], int(data["current_count"]))
+            if "previous" in data:
+                self.previous = BloomFilter(self.capacity, self.error_rate, data["previous"], self.capacity)
+        except (OSError, KeyError, ValueError):
+            pass
+
+    def save(self):
+        with self.lock:
+            self.dirty = False
+            self.last_save = time.monotonic()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            arrays = {"capacity": self.capacity, "current": self.current.bits, "current_count": self.current.count}
+            if self.previous is not None:
+                arrays["previous"] = self.previous.bits
+            tmp_path = self.path + ".tmp.npz"
+            np.savez_compressed(tmp_path, **arrays)
+            os.replace(tmp_path, self.path)
+
+    def seen(self, h1, h2):
+        with self.lock:
+            hit = self.current.contains(h1, h2)
+            if self.previous is not None:
+                hit |= self.previous.contains(h1, h2)
+            return hit
+
+    def add(self, h1, h2):
+        with self.lock:
+            self.current.add(h1, h2)
+            if self.current.full:
+                self.previous = self.current
+                self.current = BloomFilter(self.capacity, self.error_rate)
+            self.dirty = True
+            due = time.monotonic() - self.last_save > SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def flush(self):
+        if self.dirty:
+            self.save()
+
+    def record(self, checked, rejected, exhausted=0):
+        with self.lock:
+            self.stats["checked"] += checked
+            self.stats["rejected"] += rejected
+            self.stats["exhausted"] += exhausted
+
+    def snapshot(self):
+        with self.lock:
+            checked = self.stats["checked"]
+            return dict(
+                self.stats,
+                rejection_rate=self.stats["rejected"] / checked if checked else 0.0,
+                remembered=self.current.count + (self.previous.count if self.previous else 0),
+                memory_bytes=self.current.bits.nbytes + (self.previous.bits.nbytes if self.previous else 0),
+            )
+
+
+_FILTER = {}
+_FILTER_LOCK = threading.Lock()
+
+
+def get_novelty_filter():
+    """进程级共享的“见过的组合”集合 (跨 Session、跨重启)"""
+    with _FILTER_LOCK:
+        if "default" not in _FILTER:
+            _FILTER["default"] = RotatingBloom()
+            atexit.register(_FILTER["default"].flush)
+        return _FILTER["default"]
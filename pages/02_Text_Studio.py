@@ -3,7 +3,7 @@ import sys
 import os
 import random
 import time
-import urllib.parse # 用于URL编码
+import datetime
 
 # ===========================
 # 0. 基础设置
@@ -13,8 +13,14 @@ parent_dir = os.path.abspath(os.path.join(current_dir, '..'))
 if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
-from engine_manager import init_data, render_sidebar, fetch_image_refs_auto
+from engine_manager import init_data, render_sidebar
 from style_manager import apply_pro_style
+from image_manager import get_image_manifest, get_thumbnail_cache, display_path
+from upload_manager import ingest_upload
+from similarity_manager import get_similarity_index
+from feature_manager import LOOKS, get_feature_table
+from text_manager import TEXT_DIR, PLACEHOLDER_WORDS, load_text_bank, build_text_prompt, iter_text_prompts
+from spool_manager import write_spool, read_spool, discard_spool
 
 try:
     from streamlit import fragment
@@ -31,48 +37,32 @@ if "uploader_key" not in st.session_state:
 if "selected_assets" not in st.session_state:
     st.session_state.selected_assets = set()
 
+# 单词下拉框最多列出的词数 (每次 rerun 都要整表发给浏览器)
+PICK_LIST_LIMIT = 2000
+
+# 画廊每页的行数 (每页张数 = 列数 × 行数)
+GALLERY_ROWS = 4
+
+if "gallery_page" not in st.session_state:
+    st.session_state.gallery_page = 0
+
+# 批量模式：结果边生成边写进暂存文件，session_state 里只留文件路径和条数
+BULK_MAX = 100000
+BULK_PREVIEW = 5
+PAIR_LABELS = {"Random pairs": "replace", "Unique pairs": "unique", "All combinations": "cartesian"}
+
 # ===========================
-# 🔥 新增：暴力直读函数 (绕过缓存和后缀限制) 🔥
+# 文字词库 (进程级缓存，文件没变化时 rerun 不碰硬盘)
 # ===========================
-def load_local_text_data_force():
-    """强制扫描 data/text 下所有包含 'text_' 的文件，不管有没有后缀"""
-    data_path = os.path.join(parent_dir, "data", "text")
-    local_db = {}
-    
-    if not os.path.exists(data_path):
-        st.error(f"❌ 错误：找不到路径 {data_path}")
-        return {}
-
+def load_local_text_data():
+    """data/text 下所有包含 'text_' 的文件，不管有没有后缀；返回的是共享对象，只读"""
     try:
-        files = os.listdir(data_path)
-        # 只要文件名包含 text_ 就读，不管它是 .txt 还是没后缀
-        target_files = [f for f in files if "text_" in f]
-        
-        for f in target_files:
-            full_path = os.path.join(data_path, f)
-            content = ""
-            try:
-                # 优先尝试 utf-8
-                with open(full_path, "r", encoding="utf-8") as file:
-                    content = file.read()
-            except UnicodeDecodeError:
-                # 如果失败尝试 gbk (防止中文乱码)
-                try:
-                    with open(full_path, "r", encoding="gbk") as file:
-                        content = file.read()
-                except:
-                    continue # 实在读不了就跳过
-            
-            # 按行切割，去除首尾空格，过滤空行
-            words = [line.strip() for line in content.split('\n') if line.strip()]
-            
-            # key 直接用文件名
-            local_db[f] = words
-            
+        return load_text_bank(TEXT_DIR)
+    except FileNotFoundError:
+        st.error(f"❌ 错误：找不到路径 {TEXT_DIR}")
     except Exception as e:
         st.error(f"读取文件出错: {e}")
-        
-    return local_db
+    return {}
 
 # ===========================
 # 1. 核心回调 (Callbacks)
@@ -89,14 +79,42 @@ def delete_asset(file_path, file_name):
             os.remove(file_path)
         if file_name in st.session_state.selected_assets:
             st.session_state.selected_assets.remove(file_name)
+        get_image_manifest().refresh(force=True)
     except Exception as e:
         print(f"Delete Error: {e}")
 
 def toggle_all_selection(all_files_list):
-    if len(st.session_state.selected_assets) == len(all_files_list) and len(all_files_list) > 0:
-        st.session_state.selected_assets = set()
+    """对当前筛选出的全部图片 (不只是当前页) 全选 / 全不选"""
+    target = set(all_files_list)
+    if target and target <= st.session_state.selected_assets:
+        st.session_state.selected_assets -= target
     else:
-        st.session_state.selected_assets = set(all_files_list)
+        st.session_state.selected_assets |= target
+
+def show_similar(file_name):
+    st.session_state.gallery_similar_to = file_name
+
+def clear_similar():
+    st.session_state.gallery_similar_to = None
+
+def drop_bulk_result():
+    """丢掉上一次批量结果的暂存文件 (已经交给 Automation 队列的那份留着)"""
+    old = st.session_state.get("text_bulk_result")
+    queued = st.session_state.get("queue_spool")
+    if old and not (queued and queued["path"] == old["path"]):
+        discard_spool(old)
+    st.session_state.text_bulk_result = None
+
+def change_gallery_page(delta, page_count):
+    st.session_state.gallery_page = min(max(st.session_state.gallery_page + delta, 0), page_count - 1)
+
+def day_range_ns(dates):
+    """date_input 的 (起, 止) -> 纳秒时间戳区间 [起 00:00, 止次日 00:00)"""
+    if not dates:
+        return None, None
+    start, end = dates[0], dates[-1]
+    to_ns = lambda d: int(datetime.datetime.combine(d, datetime.time()).timestamp() * 1e9)
+    return to_ns(start), to_ns(end + datetime.timedelta(days=1))
 
 # ===========================
 # 2. CSS 样式 (无框 + 蓝色链接)
@@ -136,15 +154,14 @@ with c_view:
     col_count = col_map[layout_mode]
 
 if uploaded_file is not None:
-    save_dir = "images"
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
-    file_path = os.path.join(save_dir, uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # 分块落盘 + 哈希去重：同一张图换了文件名也只存一份，同名不同图不会互相覆盖
+    result = ingest_upload(uploaded_file, uploaded_file.name)
     st.session_state.uploader_key += 1
-    st.session_state.selected_assets.add(uploaded_file.name)
-    st.toast(f"✅ Saved")
+    st.session_state.selected_assets.add(result["name"])
+    if result["status"] == "duplicate":
+        st.toast(f"♻️ Already in library: {result['name']}")
+    else:
+        st.toast(f"✅ Saved")
     time.sleep(0.5)
     st.rerun()
 
@@ -157,67 +174,149 @@ st.divider()
 def render_gallery_fragment(current_col_count):
     c_head, c_ctrl = st.columns([3, 1])
     
-    raw_map = fetch_image_refs_auto()
-    if not isinstance(raw_map, dict): raw_map = {}
-    all_files = [v for v in raw_map.values() if v]
-    full_paths = [(f, os.path.join("images", f)) for f in all_files]
-    valid_files = [x for x in full_paths if os.path.exists(x[1])]
-    valid_files.sort(key=lambda x: os.path.getmtime(x[1]), reverse=True)
-    sorted_image_files = [x[0] for x in valid_files]
-
-    st.session_state.selected_assets = {f for f in st.session_state.selected_assets if f in sorted_image_files}
+    # 清单里的文件都确实存在，且已按修改时间从新到旧排好
+    manifest = get_image_manifest()
+    # 新图 / 删图时后台补缩略图、清理孤儿缩略图；清单没变时是空操作
+    thumbs = get_thumbnail_cache()
+    thumbs.sync(manifest)
+    # 感知哈希同样按内容哈希增量计算
+    similarity = get_similarity_index()
+    similarity.sync(manifest)
+    # 尺寸 / 主色 / 墨量等特征也在后台算好，筛选时只查表
+    features = get_feature_table()
+    features.sync(manifest)
+
+    selected = st.session_state.selected_assets
+    st.session_state.selected_assets = selected = {f for f in selected if f in manifest}
+
+    # --- 筛选 (在内存索引上做，同样的条件直接命中缓存) ---
+    f_name, f_date, f_look, f_sel, f_dup = st.columns([2, 2, 1, 2, 1])
+    with f_name:
+        name_query = st.text_input("Name", key="gallery_name", placeholder="🔍 Filter by name...", label_visibility="collapsed")
+    with f_date:
+        date_range = st.date_input("Date", value=(), key="gallery_dates", label_visibility="collapsed")
+    with f_look:
+        look = st.selectbox("Look", ["Any"] + list(LOOKS), key="gallery_look", label_visibility="collapsed")
+    with f_sel:
+        sel_mode = st.radio("Selection", ["All", "Selected", "Unselected"], key="gallery_sel", horizontal=True, label_visibility="collapsed")
+    with f_dup:
+        collapse_dups = st.toggle("Collapse look-alikes", key="gallery_collapse")
+
+    names, name_set = manifest.query(name_query, *day_range_ns(date_range))
+    if look != "Any":
+        names = features.filter(names, look, manifest=manifest)
+        name_set = frozenset(names)
+    if sel_mode == "Selected":
+        # 只需遍历选中的那几张，再按修改时间从新到旧排
+        picked = [f for f in selected if f in name_set]
+        sorted_image_files = sorted(picked, key=lambda f: manifest.images[f]["mtime_ns"], reverse=True)
+    elif sel_mode == "Unselected":
+        sorted_image_files = [f for f in names if f not in selected] if selected else names
+    else:
+        sorted_image_files = names
+
+    # "≈" 找相似：只看这一张和与它相近的图 (按距离从近到远)，其他筛选暂不生效
+    similar_to = st.session_state.get("gallery_similar_to")
+    if similar_to not in manifest:
+        similar_to = st.session_state.gallery_similar_to = None
+    hidden_counts = {}
+    if similar_to:
+        sorted_image_files = [similar_to] + [f for f, _ in similarity.similar(similar_to, manifest=manifest)]
+    elif collapse_dups:
+        sorted_image_files, hidden_counts = similarity.collapse(sorted_image_files, manifest=manifest)
+
+    # 条件变了回到第一页
+    filter_key = (name_query, tuple(date_range), look, sel_mode, collapse_dups, similar_to, current_col_count)
+    if st.session_state.get("gallery_filter_key") != filter_key:
+        st.session_state.gallery_filter_key = filter_key
+        st.session_state.gallery_page = 0
+
+    page_size = current_col_count * GALLERY_ROWS
+    page_count = max(1, -(-len(sorted_image_files) // page_size))
+    page = min(st.session_state.gallery_page, page_count - 1)
+    page_files = sorted_image_files[page * page_size:(page + 1) * page_size]
 
     with c_head:
         st.subheader("Visual Library")
-        
+        if similar_to:
+            c_sim_info, c_sim_clear = st.columns([3, 1])
+            c_sim_info.caption(f"≈ Similar to **{similar_to}** · {len(sorted_image_files) - 1} found")
+            c_sim_clear.button("✖ Clear", key="gallery_similar_clear", type="secondary", use_container_width=True, on_click=clear_similar)
+
     with c_ctrl:
         if sorted_image_files:
-            is_all_selected = (len(st.session_state.selected_assets) == len(sorted_image_files)) and (len(sorted_image_files) > 0)
+            # 全选作用于筛选结果的全部页；和 toggle_all_selection 判断同一批图
+            is_all_selected = all(f in selected for f in sorted_image_files)
             btn_label = "❌ Uncheck All" if is_all_selected else "✅ Select All"
             st.button(btn_label, key="btn_toggle_all", type="secondary", use_container_width=True, on_click=toggle_all_selection, args=(sorted_image_files,))
 
     if not sorted_image_files:
-        st.info("Library is empty.")
+        st.info("Library is empty." if not len(manifest) else "No images match the filter.")
     else:
+        # 只为当前页建组件，组件数与图库大小无关
         cols = st.columns(current_col_count)
-        for idx, file_name in enumerate(sorted_image_files):
-            file_path = os.path.join("images", file_name)
+        for idx, file_name in enumerate(page_files):
+            file_path = manifest.file_path(file_name)
             col = cols[idx % current_col_count]
             
             with col:
                 with st.container(border=True):
-                    st.image(file_path, use_container_width=True)
-                    c_sel, c_del = st.columns([3, 1], gap="small")
-                    is_selected = file_name in st.session_state.selected_assets
+                    # 网格里只发缩略图，原图只在生成 Prompt 时按文件名引用
+                    st.image(display_path(manifest, file_name), use_container_width=True)
+                    if hidden_counts.get(file_name):
+                        st.caption(f"+{hidden_counts[file_name]} similar")
+                    c_sel, c_sim, c_del = st.columns([2, 1, 1], gap="small")
+                    is_selected = file_name in selected
                     
                     with c_sel:
                         if is_selected:
                             st.button("✅ Active", key=f"s_{file_name}", type="primary", use_container_width=True, on_click=toggle_selection, args=(file_name,))
                         else:
                             st.button("Select", key=f"s_{file_name}", type="secondary", use_container_width=True, on_click=toggle_selection, args=(file_name,))
+                    with c_sim:
+                        st.button("≈", key=f"m_{file_name}", type="secondary", use_container_width=True, help="Find similar", on_click=show_similar, args=(file_name,))
                     with c_del:
                         st.button("🗑", key=f"d_{file_name}", type="secondary", use_container_width=True, help="Delete", on_click=delete_asset, args=(file_path, file_name))
 
-    if st.session_state.selected_assets:
-        st.markdown(f"<div style='text-align:right; color:#4CAF50; padding-top:10px;'>✅ <b>{len(st.session_state.selected_assets)}</b> Selected</div>", unsafe_allow_html=True)
+        if page_count > 1:
+            p_prev, p_info, p_next = st.columns([1, 2, 1])
+            with p_prev:
+                st.button("◀ Prev", key="gallery_prev", disabled=page == 0, use_container_width=True, on_click=change_gallery_page, args=(-1, page_count))
+            with p_info:
+                st.markdown(f"<div style='text-align:center; color:#888; padding-top:8px;'>Page {page + 1} / {page_count} · {len(sorted_image_files)} images</div>", unsafe_allow_html=True)
+            with p_next:
+                st.button("Next ▶", key="gallery_next", disabled=page >= page_count - 1, use_container_width=True, on_click=change_gallery_page, args=(1, page_count))
+
+    pending = thumbs.snapshot()["pending"]
+    if pending:
+        st.caption(f"🖼 正在后台生成 {pending} 张缩略图...")
+    hashing = similarity.snapshot()["pending"]
+    if hashing:
+        st.caption(f"≈ 正在后台计算 {hashing} 张图的相似度指纹...")
+    extracting = features.snapshot()["pending"]
+    if extracting:
+        st.caption(f"🎨 正在后台分析 {extracting} 张图的颜色和线条，Look 筛选暂不包含这些图...")
+
+    if selected:
+        st.markdown(f"<div style='text-align:right; color:#4CAF50; padding-top:10px;'>✅ <b>{len(selected)}</b> Selected</div>", unsafe_allow_html=True)
 
 render_gallery_fragment(col_count)
 
 st.divider()
 
 # ===========================
-# 5. 生成控制区 (🔥 使用暴力读取的数据 🔥)
+# 5. 生成控制区
 # ===========================
 
-# 每次刷新页面时，现场读取硬盘文件
-local_db = load_local_text_data_force()
+# 进程级共享的词库 (只读)；文件改了才会重新读
+local_db = load_local_text_data()
 
 # 筛选语种 (只要文件名包含 text_ 就行，不再依赖 .txt 后缀)
 available_files = sorted(list(local_db.keys()))
 if not available_files:
     # 如果实在啥都没读到，给个默认的，防止报错
     available_files = ["text_en.txt"]
-    local_db["text_en.txt"] = ["LOVE", "HOPE", "FAITH (Demo)"]
+    local_db = {"text_en.txt": ("LOVE", "HOPE", "FAITH (Demo)")}
 
 c_lang, c_word, c_qty, c_go = st.columns([1, 1, 0.8, 1])
 
@@ -227,60 +326,99 @@ with c_lang:
 
 # 3. 单词选择
 with c_word:
-    # 从暴力读取的 local_db 中拿数据
-    current_words_pool = local_db.get(target_file, ["(Empty)"])
-    if not current_words_pool: current_words_pool = ["(Empty File)"]
+    current_words_pool = local_db.get(target_file, ("(Empty)",))
+    if not current_words_pool: current_words_pool = ("(Empty File)",)
     
-    # 显示总词数，方便确认是否读全了
-    word_options = [f"🎲 Random ({len(current_words_pool)} words)"] + current_words_pool
+    # 显示总词数，方便确认是否读全了；超大词库下拉框只列前 PICK_LIST_LIMIT 个，随机仍从全部词里抽
+    word_options = [f"🎲 Random ({len(current_words_pool)} words)"] + list(current_words_pool[:PICK_LIST_LIMIT])
     selected_word_opt = st.selectbox("Pick Word", word_options, label_visibility="collapsed")
 
 with c_qty:
-    qty = st.number_input("Qty", 1, 10, 4, label_visibility="collapsed")
+    if st.session_state.get("text_bulk"):
+        qty = st.number_input("Qty", 1, BULK_MAX, 1000, step=100, key="text_bulk_qty", label_visibility="collapsed")
+    else:
+        qty = st.number_input("Qty", 1, 10, 4, label_visibility="collapsed")
 with c_go:
     run_btn = st.button("🚀 GENERATE", type="primary", use_container_width=True)
 
 manual_word = st.text_input("Custom Text", placeholder="Input text here (Optional)...", label_visibility="collapsed")
+c_ar, c_bulk, c_pairs, c_dest = st.columns([1.2, 0.8, 2, 1.2])
+with c_ar:
+    match_ar = st.checkbox("Match reference aspect ratio (--ar)", key="text_match_ar")
+with c_bulk:
+    bulk_mode = st.toggle("Bulk", key="text_bulk")
+if bulk_mode:
+    with c_pairs:
+        pair_label = st.radio("Pairs", list(PAIR_LABELS), key="text_pairs", horizontal=True, label_visibility="collapsed")
+    with c_dest:
+        bulk_dest = st.radio("Output", ["Automation queue", "File"], key="text_dest", horizontal=True, label_visibility="collapsed")
+
+def pick_words():
+    """本次可用的词 (手填 > 下拉选中 > 整个词库去掉占位符)"""
+    if manual_word.strip():
+        return [manual_word.strip()]
+    if "Random" not in selected_word_opt:
+        return [selected_word_opt]
+    return [w for w in current_words_pool if w not in PLACEHOLDER_WORDS] or ["LOVE"]
 
 # ===========================
 # 6. 生成逻辑 (去风格 + 纯净Prompt)
 # ===========================
-if run_btn:
+if run_btn and bulk_mode:
+    try:
+        with st.spinner("Processing..."):
+            manifest = get_image_manifest()
+            active_pool = [f for f in st.session_state.selected_assets if f in manifest]
+            images = get_similarity_index().diverse_order(active_pool, manifest=manifest)
+            ars = None
+            if match_ar:
+                feature_table = get_feature_table()
+                ars = {img: (feature_table.get(img, manifest) or {}).get("ar") for img in images}
+            # 词 / 图按下标数组批量抽，URL 只 quote 一次；一块一块写进文件，不整批放在内存里
+            chunks = iter_text_prompts(pick_words(), images, qty, PAIR_LABELS[pair_label], ars=ars)
+            spool = write_spool(([row[3] for row in rows] for rows in chunks), prefix="text")
+
+        drop_bulk_result()
+        st.session_state.text_bulk_result = spool
+        st.session_state.text_bulk_dest = bulk_dest
+        st.session_state.text_solutions = []
+        if bulk_dest == "Automation queue":
+            # 队列那边从文件里按段取，换掉上一份还没取完的暂存
+            if st.session_state.get("queue_spool"):
+                discard_spool(st.session_state.queue_spool)
+            st.session_state.queue_spool = spool
+        st.rerun()
+    except Exception as e:
+        st.error(str(e))
+
+elif run_btn:
     try:
         with st.spinner("Processing..."):
             results = []
-            active_pool = list(st.session_state.selected_assets)
-            
-            GITHUB_RAW_BASE = "https://raw.githubusercontent.com/losran/Tattoo_Engine_V2/main/images/"
+            # 只用图库里还存在的图 (选中后可能被别的 Session 删掉)
+            manifest = get_image_manifest()
+            active_pool = [f for f in st.session_state.selected_assets if f in manifest]
+            # 最远点顺序轮流取图：长得像的图不会挨着被抽到
+            image_order = get_similarity_index().diverse_order(active_pool, manifest=manifest)
+
+            # 词池只过滤一次 (占位符已去掉)
+            words = pick_words()
 
             for i in range(qty):
                 # 🔥 1. 确定单词
-                if manual_word.strip():
-                    final_word = manual_word.strip()
-                elif "Random" in selected_word_opt:
-                    # 过滤掉可能的空占位符
-                    valid_pool = [w for w in current_words_pool if w not in ["(Empty)", "(Empty File)"]]
-                    if valid_pool:
-                        final_word = random.choice(valid_pool)
-                    else:
-                        final_word = "LOVE"
-                else:
-                    final_word = selected_word_opt
+                final_word = random.choice(words)
 
                 # 2. 图片处理
-                img_val = random.choice(active_pool) if active_pool else ""
-                full_img_url = ""
-                if img_val:
-                    safe_filename = urllib.parse.quote(img_val)
-                    full_img_url = f"{GITHUB_RAW_BASE}{safe_filename}"
+                img_val = image_order[i % len(image_order)] if image_order else ""
                 
                 # 🔥 3. Prompt 构造 (纯净版)
-                url_part = f"{full_img_url} " if full_img_url else ""
-                prefix = f"**方案{i+1}：** "
-                prompt_text = f"{prefix}{url_part}Tattoo design of the word '{final_word}', clean white background, high contrast --iw 2 **"
+                # 宽高比直接查特征表，不用在这里打开图片
+                feat = get_feature_table().get(img_val, manifest) if (match_ar and img_val) else None
+                prompt_text = build_text_prompt(i + 1, final_word, img_val, ar=feat["ar"] if feat else None)
                 
                 results.append({"image_file": img_val, "prompt_text": prompt_text})
             
+            drop_bulk_result()
             st.session_state.text_solutions = results
             time.sleep(0.3)
             st.rerun()
@@ -291,6 +429,24 @@ if run_btn:
 # ===========================
 # 7. 结果展示 (列表布局 + 无框 + 蓝色链接)
 # ===========================
+bulk_result = st.session_state.get("text_bulk_result")
+if bulk_result and os.path.exists(bulk_result["path"]):
+    st.write("")
+    st.subheader("Results")
+    # 只预览前几条，全部结果在暂存文件里
+    with st.container(border=True):
+        st.markdown(f"✅ **{bulk_result['total']}** prompts generated")
+        for prompt in read_spool(bulk_result, BULK_PREVIEW, start=0):
+            st.markdown(prompt)
+        if bulk_result["total"] > BULK_PREVIEW:
+            st.caption(f"... {bulk_result['total'] - BULK_PREVIEW} more")
+
+    if st.session_state.get("text_bulk_dest") == "File":
+        with open(bulk_result["path"], "rb") as f:
+            st.download_button("⬇ Download Prompts", f, file_name=os.path.basename(bulk_result["path"]), mime="text/plain", type="primary", use_container_width=True)
+    elif st.button("Open Automation Queue", type="primary", use_container_width=True):
+        st.switch_page("pages/03_Automation.py")
+
 if "text_solutions" in st.session_state and st.session_state.text_solutions:
     st.write("") 
     st.subheader("Results")
@@ -300,10 +456,8 @@ if "text_solutions" in st.session_state and st.session_state.text_solutions:
             col_img, col_text = st.columns([1, 4])
             
             with col_img:
-                if item["image_file"]:
-                    full_path = os.path.abspath(os.path.join("images", item["image_file"]))
-                    if os.path.exists(full_path):
-                        st.image(full_path, use_container_width=True)
+                if item["image_file"] and item["image_file"] in get_image_manifest():
+                    st.image(display_path(get_image_manifest(), item["image_file"]), use_container_width=True)
             
             with col_text:
                 st.markdown(item['prompt_text'])
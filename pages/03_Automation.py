@@ -15,6 +15,7 @@ if parent_dir not in sys.path:
 
 from engine_manager import render_sidebar, init_data
 from style_manager import apply_pro_style
+from spool_manager import take_spool, remaining, discard_spool
 
 # ===========================
 # 1. Page Config
@@ -34,6 +35,12 @@ if "global_queue" not in st.session_state:
 if not st.session_state.global_queue and "text_solutions" in st.session_state and st.session_state.text_solutions:
     st.session_state.global_queue = [item["prompt_text"] for item in st.session_state.text_solutions if "prompt_text" in item]
 
+# Text Studio 批量模式的结果放在暂存文件里，这里按段取进队列
+SPOOL_LOAD_DEFAULT = 50
+spool = st.session_state.get("queue_spool")
+if spool and not remaining(spool):
+    st.session_state.queue_spool = spool = None
+
 current_queue_text = ""
 if st.session_state.global_queue:
     current_queue_text = "\n\n".join(st.session_state.global_queue)
@@ -50,9 +57,23 @@ with col_info:
 with col_clear:
     if st.button("Clear Queue", use_container_width=True):
         st.session_state.global_queue = []
+        if spool:
+            discard_spool(spool)
+            st.session_state.queue_spool = None
         if "text_solutions" in st.session_state: st.session_state.text_solutions = [] 
         st.rerun()
 
+if spool:
+    col_spool, col_n, col_load = st.columns([3, 1, 1])
+    with col_spool:
+        st.markdown(f"**Spooled:** {remaining(spool)} more tasks waiting (not loaded yet)")
+    with col_n:
+        load_n = st.number_input("Load", 1, 1000, SPOOL_LOAD_DEFAULT, key="spool_load_n", label_visibility="collapsed")
+    with col_load:
+        if st.button("Load Next", key="spool_load", use_container_width=True):
+            st.session_state.global_queue.extend(take_spool(spool, load_n))
+            st.rerun()
+
 user_input = st.text_area(
     "Queue Preview", 
     value=current_queue_text, 
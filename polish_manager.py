@@ -0,0 +1,176 @@
+import json
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# 1. 润色 Prompt
+# ==========================================
+POLISH_MODEL = "deepseek-chat"
+
+SYS_PROMPT = """你是一位顶级的纹身艺术策展人。
+    任务：将给定的【关键词骨架】转化为极具冲击力的纹身设计方案。
+    规则：
+    1. 必须保留骨架中所有的关键词信息，特别是主体中排在第一位的用户核心词。
+    2. 描述必须包含'微型纹身'二字。
+    3. 语言风格：高级、艺术感、富有画面张力。
+    """
+
+
+def build_polish_prompt(idx, sk):
+    return f"""
+        【原始关键词骨架】：{sk}
+
+        【定制指令】：
+        1. 严格以 "**方案{idx}：**" 开头。
+        2. 将字数扩展至 80-120 字。
+        3. 这是一个组合任务：请将骨架里的关键词（{sk}）有机融合，不要遗漏用户输入的词。
+        """
+
+
+def build_batch_prompt(items):
+    """items: [(方案编号, 骨架)]，一次请求润色多套"""
+    lines = "\n".join(f"方案{idx}：{sk}" for idx, sk in items)
+    return f"""
+        【批量骨架】(共 {len(items)} 套)：
+{lines}
+
+        【定制指令】：
+        1. 逐套润色，每套都严格以 "**方案N：**" 开头 (N 为上面的方案编号)。
+        2. 每套扩展至 80-120 字，保留该套骨架里的全部关键词。
+        3. 只输出一个 JSON 字符串数组，按方案编号顺序，每个元素是一套完整方案，不要输出其他内容。
+        """
+
+
+def offline_solution(idx, sk):
+    return f"**方案{idx}：** {sk} (AI Offline)"
+
+
+def error_solution(idx, sk, e):
+    return f"**方案{idx}：** {sk} (Error: {str(e)})"
+
+
+def stream_polish(client, idx, sk):
+    """逐段产出一个方案的润色文本"""
+    stream = client.chat.completions.create(
+        model=POLISH_MODEL,
+        messages=[{"role": "system", "content": SYS_PROMPT}, {"role": "user", "content": build_polish_prompt(idx, sk)}],
+        temperature=0.9,
+        stream=True
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+# ==========================================
+# 2. 批量润色 (K 套骨架合成一个请求)
+# ==========================================
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_batch_response(res, items):
+    """
+    JSON 数组 -> {方案编号: 文本}。
+    按每个元素开头的 "**方案N：**" 对号入座，编号对不上、重复或缺失的方案不出现在结果里
+    """
+    try:
+        data = json.loads(_FENCE.sub("", res.strip()))
+    except (ValueError, AttributeError):
+        return {}
+    if isinstance(data, dict):
+        # 有的模型会包一层 {"solutions": [...]}
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    if not isinstance(data, list):
+        return {}
+
+    wanted = {idx for idx, _ in items}
+    out = {}
+    for text in data:
+        if not isinstance(text, str):
+            continue
+        m = re.match(r"\s*\*\*方案(\d+)：\*\*", text)
+        if m and int(m.group(1)) in wanted and int(m.group(1)) not in out:
+            out[int(m.group(1))] = text.strip()
+    return out
+
+
+def polish_batch(client, items):
+    """一次请求润色 items 里的全部骨架，返回 {方案编号: 文本} (只含校验通过的)"""
+    response = client.chat.completions.create(
+        model=POLISH_MODEL,
+        messages=[{"role": "system", "content": SYS_PROMPT}, {"role": "user", "content": build_batch_prompt(items)}],
+        temperature=0.9,
+    )
+    return parse_batch_response(response.choices[0].message.content, items)
+
+
+# ==========================================
+# 3. 并发润色 (多路流式 / 批量)
+# ==========================================
+def iter_polish_events(client, skeletons, max_workers=4, batch_size=1, numbers=None):
+    """
+    同时发起所有方案的请求 (最多 max_workers 路并发)，
+    按到达顺序产出事件：
+        ("delta", i, 片段)   —— 第 i 个方案收到新 token
+        ("done",  i, 全文)
+        ("error", i, 异常)   —— 只影响这一个方案
+    batch_size > 1 时每 batch_size 套骨架合成一个请求 (不流式)，
+    结果里缺失或格式不对的方案再单独走一次流式请求补上。
+    numbers 是每套骨架的方案编号 (默认 1..N)，事件里的 i 始终是 skeletons 的下标。
+    事件在调用方线程 (Streamlit 脚本线程) 里消费，工作线程从不直接碰 st.*
+    """
+    events = queue.Queue()
+    stop = threading.Event()
+    numbers = list(numbers) if numbers is not None else list(range(1, len(skeletons) + 1))
+
+    def work(i, sk):
+        # 调用方已经放弃 (rerun / 停止) 就不再发请求
+        if stop.is_set():
+            return
+        parts = []
+        try:
+            for piece in stream_polish(client, numbers[i], sk):
+                if stop.is_set():
+                    return
+                parts.append(piece)
+                events.put(("delta", i, piece))
+            events.put(("done", i, "".join(parts)))
+        except Exception as e:
+            events.put(("error", i, e))
+
+    def work_batch(start, group):
+        if stop.is_set():
+            return
+        items = [(numbers[start + j], sk) for j, sk in enumerate(group)]
+        try:
+            solved = polish_batch(client, items)
+        except Exception:
+            solved = {}
+        for j, sk in enumerate(group):
+            if stop.is_set():
+                return
+            if numbers[start + j] in solved:
+                events.put(("done", start + j, solved[numbers[start + j]]))
+            else:
+                work(start + j, sk)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="polish")
+    try:
+        if batch_size > 1:
+            for start in range(0, len(skeletons), batch_size):
+                pool.submit(work_batch, start, skeletons[start:start + batch_size])
+        else:
+            for i, sk in enumerate(skeletons):
+                pool.submit(work, i, sk)
+        remaining = len(skeletons)
+        while remaining:
+            event = events.get()
+            if event[0] != "delta":
+                remaining -= 1
+            yield event
+    finally:
+        # 页面中途 rerun 时让还没结束的流尽快退出，排队中的请求直接取消
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
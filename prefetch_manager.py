@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ==========================================
+# 1. 预取：趁用户看结果时在后台把下一批做好
+# ==========================================
+# 做好未取的预取批次上限，超出时丢掉最老的 (在飞的批次从不丢弃)
+PREFETCH_MAX_BATCHES = 4
+# 同时在后台生成的批次上限 (所有 Session 合计)，满了就不再预取，API 花费有上界
+PREFETCH_MAX_PENDING = 2
+# 做好后多久没人取就作废 (秒)
+PREFETCH_MAX_AGE = 600.0
+
+
+class _Entry:
+    def __init__(self, owner):
+        self.owner = owner
+        self.created = time.monotonic()
+        self.done = threading.Event()
+        self.cancel = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Prefetcher:
+    """
+    key -> 后台生成的一批结果。
+    每个 key 同时只有一个预取任务；同一个 owner (Session) 换了设置时，旧的预取立即取消。
+    在飞数、做好未取数和存活时间都有上限，API 花费可预期。
+    build(cancel) 在工作线程里执行，不能碰 st.*；cancel 被置位时应尽快放弃并返回
+    """
+
+    def __init__(self, max_batches=PREFETCH_MAX_BATCHES, max_pending=PREFETCH_MAX_PENDING, max_age=PREFETCH_MAX_AGE):
+        self.max_batches = max_batches
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = {"scheduled": 0, "hits": 0, "evicted": 0, "failed": 0, "cancelled": 0, "skipped": 0}
+
+    def _evict_locked(self):
+        """只丢已经做好的批次：先丢过期的，再按先后丢到不超过上限"""
+        now = time.monotonic()
+        for key in [k for k, e in self.entries.items() if e.done.is_set() and now - e.created > self.max_age]:
+            del self.entries[key]
+            self.stats["evicted"] += 1
+        ready = [k for k, e in self.entries.items() if e.done.is_set()]
+        for key in ready[:max(len(ready) - self.max_batches, 0)]:
+            del self.entries[key]
+            self.stats["evicted"] += 1
+
+    def _cancel_locked(self, key):
+        entry = self.entries[key]
+        entry.cancel.set()
+        self.stats["cancelled"] += 1
+        if entry.done.is_set():
+            del self.entries[key]
+        # 还在飞的留在表里占着名额，线程结束时自己移除
+
+    def schedule(self, key, build, owner=None):
+        """key 没有现成或在飞的预取、且在飞数没满时，后台跑 build(cancel) 一次"""
+        with self.lock:
+            self._evict_locked()
+            if key in self.entries:
+                return False
+            if owner is not None:
+                for other in [k for k, e in self.entries.items() if e.owner == owner and not e.cancel.is_set()]:
+                    self._cancel_locked(other)
+            if sum(1 for e in self.entries.values() if not e.done.is_set()) >= self.max_pending:
+                self.stats["skipped"] += 1
+                return False
+            entry = self.entries[key] = _Entry(owner)
+            self.stats["scheduled"] += 1
+
+        def run():
+            try:
+                entry.result = build(entry.cancel)
+            except Exception as e:
+                entry.error = e
+            with self.lock:
+                entry.done.set()
+                if entry.cancel.is_set() and self.entries.get(key) is entry:
+                    del self.entries[key]
+
+        threading.Thread(target=run, name="prefetch", daemon=True).start()
+        return True
+
+    def take(self, key):
+        """
+        取走 key 已经做好的预取结果；没有、失败或还在生成都返回 None (不等待)。
+        还在生成的那批留着，下一次生成时再取
+        """
+        with self.lock:
+            self._evict_locked()
+            entry = self.entries.get(key)
+            if entry is None or not entry.done.is_set():
+                return None
+            del self.entries[key]
+            if entry.error is not None or entry.result is None:
+                self.stats["failed"] += 1
+                return None
+            self.stats["hits"] += 1
+            return entry.result
+
+    def snapshot(self):
+        with self.lock:
+            ready = sum(1 for e in self.entries.values() if e.done.is_set())
+            return dict(self.stats, ready=ready, pending=len(self.entries) - ready)
+
+
+_PREFETCHERS = {}
+_PREFETCHERS_LOCK = threading.Lock()
+
+
+def get_prefetcher(name):
+    """进程级共享，按用途区分 (例如 "graphic")"""
+    with _PREFETCHERS_LOCK:
+        if name not in _PREFETCHERS:
+            _PREFETCHERS[name] = Prefetcher()
+        return _PREFETCHERS[name]
@@ -0,0 +1,215 @@
+import random
+import threading
+import time
+
+# ==========================================
+# 1. 参数
+# ==========================================
+# 令牌桶：每秒发放的请求数 (会随 429 自动下调、成功后慢慢恢复) 与突发容量
+RATE_MAX = 20.0
+RATE_MIN = 0.5
+RATE_INITIAL = 10.0
+RATE_RECOVERY = 0.1        # 每次成功恢复多少 req/s
+BURST = 10.0
+
+# 并发上限 (AIMD)：成功时 +1/limit，429 时减半，延迟明显变高时 ×0.9
+CONCURRENCY_MAX = 32       # 与 ai_manager 的连接池大小一致
+CONCURRENCY_MIN = 1
+CONCURRENCY_INITIAL = 8
+LATENCY_SPIKE = 2.0        # 近期延迟超过长期基线的几倍算拥塞
+DECREASE_COOLDOWN = 1.0    # 两次下调之间至少隔多久，避免一批 429 把上限砍到底
+
+# 重试：指数退避 + 全抖动，每个请求有总期限
+RETRY_BASE = 1.0
+RETRY_MAX = 20.0
+DEADLINE = 90.0
+
+RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+RETRYABLE_ERRORS = ("APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError")
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def _status(e):
+    return getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+
+
+def is_throttled(e):
+    return _status(e) == 429 or type(e).__name__ == "RateLimitError"
+
+
+def is_retryable(e):
+    return _status(e) in RETRYABLE_STATUS or type(e).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(e):
+    """服务端给了 Retry-After (秒) 就照办"""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ==========================================
+# 2. 调度器
+# ==========================================
+class RequestScheduler:
+    """
+    进程内所有 DeepSeek 调用共用：
+    令牌桶控制速率，AIMD 控制同时在飞的请求数，可重试的错误按退避重发直到期限。
+    流式请求的并发名额一直占到流结束。
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.rate = RATE_INITIAL
+        self.tokens = BURST
+        self.refilled = time.monotonic()
+        self.limit = float(CONCURRENCY_INITIAL)
+        self.in_flight = 0
+        # 流式请求量到开始出字，非流式量到整段返回，两种耗时不能混在一起比：
+        # stream -> [近期延迟 (EWMA α=0.3), 长期基线 (EWMA α=0.02)]
+        self.latency = {True: [None, None], False: [None, None]}
+        self.last_decrease = 0.0
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "failed": 0, "deadline": 0}
+
+    # --- 名额 ---
+    def _refill_locked(self, now):
+        self.tokens = min(BURST, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def _acquire(self, deadline):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._refill_locked(now)
+                if self.in_flight < int(self.limit) and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.in_flight += 1
+                    return
+                if now >= deadline:
+                    self.stats["deadline"] += 1
+                    raise DeadlineExceeded("等待请求名额超时")
+                # 缺令牌时算出下一个令牌的到达时间；缺并发名额时等 release 唤醒
+                wait = (1.0 - self.tokens) / self.rate if self.tokens < 1.0 else deadline - now
+                self.cond.wait(min(wait, deadline - now))
+
+    def _release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    # --- 反馈 ---
+    def _decrease_locked(self, factor, now):
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+        self.last_decrease = now
+        self.limit = max(CONCURRENCY_MIN, self.limit * factor)
+
+    def _on_success(self, latency, stream=False):
+        with self.cond:
+            now = time.monotonic()
+            ewma = self.latency[stream]
+            if ewma[0] is None:
+                ewma[0] = ewma[1] = latency
+            ewma[0] += 0.3 * (latency - ewma[0])
+            ewma[1] += 0.02 * (latency - ewma[1])
+            if ewma[0] > LATENCY_SPIKE * ewma[1]:
+                self._decrease_locked(0.9, now)
+            else:
+                self.limit = min(CONCURRENCY_MAX, self.limit + 1.0 / self.limit)
+            self.rate = min(RATE_MAX, self.rate + RATE_RECOVERY)
+            self.cond.notify_all()
+
+    def _on_throttled(self):
+        with self.cond:
+            now = time.monotonic()
+            if now - self.last_decrease >= DECREASE_COOLDOWN:
+                self.rate = max(RATE_MIN, self.rate * 0.5)
+            self._decrease_locked(0.5, now)
+            self.stats["throttled"] += 1
+
+    # --- 调用 ---
+    def call(self, fn, stream=False, deadline=DEADLINE):
+        """
+        fn() 发起一次请求。可重试的失败按退避重发，超过期限抛出最后一次的错误。
+        stream=True 时 fn 返回可迭代的流，名额在流迭代结束 (或被丢弃) 时归还。
+        """
+        end = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            self._acquire(end)
+            start = time.monotonic()
+            try:
+                res = fn()
+            except Exception as e:
+                self._release()
+                if is_throttled(e):
+                    self._on_throttled()
+                if not is_retryable(e):
+                    with self.cond:
+                        self.stats["failed"] += 1
+                    raise
+                backoff = retry_after(e) or random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+                if time.monotonic() + backoff >= end:
+                    with self.cond:
+                        self.stats["deadline"] += 1
+                    raise
+                with self.cond:
+                    self.stats["retries"] += 1
+                attempt += 1
+                time.sleep(backoff)
+                continue
+
+            self._on_success(time.monotonic() - start, stream)
+            with self.cond:
+                self.stats["requests"] += 1
+            if stream:
+                return _HeldStream(res, self._release)
+            self._release()
+            return res
+
+    def snapshot(self):
+        with self.cond:
+            snap = dict(
+                self.stats, rate=round(self.rate, 2), concurrency_limit=int(self.limit),
+                in_flight=self.in_flight,
+            )
+            for stream, prefix in ((False, "latency"), (True, "stream_latency")):
+                fast, slow = self.latency[stream]
+                snap[f"{prefix}_recent"] = round(fast, 3) if fast is not None else None
+                snap[f"{prefix}_baseline"] = round(slow, 3) if slow is not None else None
+            return snap
+
+
+class _HeldStream:
+    """流结束、出错或对象被回收时归还并发名额 (只还一次)"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.release()
+
+    def __del__(self):
+        self.close()
+
+
+SCHEDULER = RequestScheduler()
+
+
+def get_scheduler():
+    return SCHEDULER
@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from image_manager import ContentHashJobs, get_image_manifest, save_json_atomic
+from warehouse_manager import CACHE_DIR
+
+# ==========================================
+# 1. 感知哈希 (aHash / dHash，64 位)
+# ==========================================
+PHASH_FILE = os.path.join(CACHE_DIR, "phash_index.json")
+
+# dHash 汉明距离不超过这个值就算“长得像”
+SIMILAR_DISTANCE = 10
+
+
+def _bits_to_int(bits):
+    return int(np.packbits(bits.astype(np.uint8)).view(">u8")[0])
+
+
+def perceptual_hashes(path):
+    """在子进程里跑：返回 (aHash, dHash)"""
+    with Image.open(path) as img:
+        img.draft("L", (64, 64))
+        gray = img.convert("L")
+        small = np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.float32)
+        tiny = np.asarray(gray.resize((8, 8), Image.Resampling.LANCZOS), dtype=np.float32)
+    ahash = _bits_to_int((tiny > tiny.mean()).ravel())
+    dhash = _bits_to_int((small[:, 1:] > small[:, :-1]).ravel())
+    return ahash, dhash
+
+
+def popcount(x):
+    x = np.asarray(x, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.int64)
+    return np.unpackbits(x.reshape(-1, 1).view(np.uint8), axis=1).sum(axis=1).reshape(x.shape)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# ==========================================
+# 2. BK 树 (按汉明距离的近邻查询)
+# ==========================================
+class BKTree:
+    """
+    节点 = [dHash, {内容哈希, ...}, {距离: 子节点}]。
+    删除只做标记 (查询结果再用 codes 过滤)，死节点太多时整棵重建。
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, code, digest):
+        if self.root is None:
+            self.root = [code, {digest}, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            d = hamming(code, node[0])
+            if d == 0:
+                node[1].add(digest)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [code, {digest}, {}]
+                self.size += 1
+                return
+            node = child
+
+    def query(self, code, max_distance):
+        """-> [(距离, 内容哈希)]，只剪枝不回溯，复杂度随阈值而不是图库大小增长"""
+        out = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(code, node[0])
+            if d <= max_distance:
+                out.extend((d, digest) for digest in node[1])
+            lo, hi = d - max_distance, d + max_distance
+            stack.extend(child for k, child in node[2].items() if lo <= k <= hi)
+        return out
+
+
+# ==========================================
+# 3. 相似度索引 (按内容哈希存，随清单增量更新)
+# ==========================================
+class SimilarityIndex(ContentHashJobs):
+    label = "Phash"
+
+    def __init__(self, path=PHASH_FILE):
+        super().__init__()
+        self.path = path
+        self.codes = {}          # 内容哈希 -> (aHash, dHash)
+        self.tree = BKTree()
+        self.dead = 0
+        self._clusters = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.codes = {k: tuple(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError):
+            self.codes = {}
+        self._rebuild_locked()
+
+    def _rebuild_locked(self):
+        self.tree = BKTree()
+        for digest, (_, dhash) in self.codes.items():
+            self.tree.add(dhash, digest)
+        self.dead = 0
+
+    def _has(self, digest):
+        return digest in self.codes
+
+    def _job(self, manifest, name, digest):
+        return perceptual_hashes, (manifest.file_path(name),)
+
+    def _prune(self, wanted):
+        gone = [d for d in self.codes if d not in wanted]
+        for digest in gone:
+            del self.codes[digest]
+        self.dead += len(gone)
+        if self.dead > len(self.codes) // 2:
+            self._rebuild_locked()
+        if gone:
+            self._clusters.clear()
+            self._flush()
+
+    def _store(self, digest, result):
+        self.codes[digest] = tuple(result)
+        self.tree.add(self.codes[digest][1], digest)
+        self._clusters.clear()
+
+    def _flush(self):
+        save_json_atomic(self.path, self.codes)
+
+    # --- 查询 (输入输出都是文件名) ---
+    def _digest_names(self, manifest):
+        names = {}
+        for name in manifest.names_by_mtime():
+            names.setdefault(manifest.images[name]["hash"], []).append(name)
+        return names
+
+    def similar(self, name, max_distance=SIMILAR_DISTANCE, manifest=None):
+        """与 name 相似的其他图 [(文件名, 距离)]，按距离从近到远"""
+        manifest = manifest or get_image_manifest()
+        info = manifest.get(name)
+        with self.lock:
+            if not info or info["hash"] not in self.codes:
+                return []
+            hits = self.tree.query(self.codes[info["hash"]][1], max_distance)
+            hits = [(d, digest) for d, digest in hits if digest in self.codes]
+        by_digest = self._digest_names(manifest)
+        out = [(n, d) for d, digest in sorted(hits) for n in by_digest.get(digest, []) if n != name]
+        return out
+
+    def _groups(self, max_distance, manifest):
+        """-> ({代表图: [同组其他图]}, {文件名: 所在组的代表图})，按清单版本和已索引数缓存"""
+        key = (manifest.version, max_distance, len(self.codes))
+        with self.lock:
+            if key in self._clusters:
+                return self._clusters[key]
+            parent = {d: d for d in self.codes}
+
+            def find(x):
+                while parent[x] != x:
+                    parent[x] = parent[parent[x]]
+                    x = parent[x]
+                return x
+
+            for digest, (_, dhash) in self.codes.items():
+                for _, other in self.tree.query(dhash, max_distance):
+                    if other in parent:
+                        parent[find(other)] = find(digest)
+            roots = {d: find(d) for d in self.codes}
+
+        groups = {}
+        for name in manifest.names_by_mtime():
+            root = roots.get(manifest.images[name]["hash"], name)
+            groups.setdefault(root, []).append(name)
+        result = {members[0]: members[1:] for members in groups.values()}
+        rep_of = {name: members[0] for members in groups.values() for name in members}
+        with self.lock:
+            self._clusters = {key: (result, rep_of)}
+        return result, rep_of
+
+    def clusters(self, max_distance=SIMILAR_DISTANCE, manifest=None):
+        """
+        近似重复分组 {代表图: [同组其他图]}，代表图是组里最新的一张。
+        用 BK 树查近邻 + 并查集合并
+        """
+        return self._groups(max_distance, manifest or get_image_manifest())[0]
+
+    def collapse(self, names, max_distance=SIMILAR_DISTANCE, manifest=None):
+        """names 里每组近似重复只留最靠前的一张 -> (留下的列表, {留下的图: 折叠掉的张数})"""
+        _, rep_of = self._groups(max_distance, manifest or get_image_manifest())
+        kept, hidden = [], {}
+        first = {}
+        for name in names:
+            rep = rep_of.get(name, name)
+            if rep in first:
+                hidden[first[rep]] += 1
+                continue
+            first[rep] = name
+            hidden[name] = 0
+            kept.append(name)
+        return kept, hidden
+
+    def diverse_order(self, names, rng=None, manifest=None):
+        """
+        最远点采样：每一步挑与已选图最小距离最大的那张。
+        返回 names 的一个排列，前面的图彼此差异尽量大，循环取用即可避开长得像的图
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        manifest = manifest or get_image_manifest()
+        names = list(names)
+        if len(names) <= 2:
+            return [names[i] for i in rng.permutation(len(names))]
+        with self.lock:
+            codes = [self.codes.get((manifest.images.get(n) or {}).get("hash")) for n in names]
+        known = [i for i, c in enumerate(codes) if c is not None]
+        unknown = [i for i, c in enumerate(codes) if c is None]
+        # 还没算出哈希的图当作与谁都不像，排在最后随机补上
+        order = []
+        if known:
+            dh = np.array([codes[i][1] for i in known], dtype=np.uint64)
+            first = int(rng.integers(len(known)))
+            min_dist = popcount(dh ^ dh[first])
+            chosen = [first]
+            min_dist[first] = -1
+            for _ in range(len(known) - 1):
+                nxt = int(np.argmax(min_dist + rng.random(len(known))))   # 随机打破平局
+                chosen.append(nxt)
+                min_dist = np.minimum(min_dist, popcount(dh ^ dh[nxt]))
+                min_dist[nxt] = -1     # 已选的图保持 -1 (取 min 后不会再变大)
+            order = [names[known[i]] for i in chosen]
+        order += [names[i] for i in rng.permutation(unknown)] if unknown else []
+        return order
+
+    def snapshot(self):
+        with self.lock:
+            return dict(super().snapshot(), indexed=len(self.codes))
+
+
+_INDEX = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def get_similarity_index():
+    with _INDEX_LOCK:
+        if "default" not in _INDEX:
+            _INDEX["default"] = SimilarityIndex()
+        return _INDEX["default"]
@@ -0,0 +1,205 @@
+import numpy as np
+
+from novelty_manager import hash_keys
+from weight_manager import AliasTable, get_weight_store, weighted_distinct_picks
+
+# ==========================================
+# 1. 配方 (与 assemble_weighted_skeleton 完全一致)
+# ==========================================
+# (标签, 分类, 最少个数, 最多个数, 出现概率)
+# 只有“主体”会真的用到多个词；其余槽位原逻辑虽然多抽但只取第一个
+RECIPE = (
+    ("动态", "Action", 1, 1, 1.0),
+    ("氛围", "Mood", 1, 1, 1.0),
+    ("主体", "Subject", 1, 2, 1.0),
+    ("风格", "StyleSystem", 1, 1, 1.0),
+    ("技法", "Technique", 1, 1, 1.0),
+    ("色调", "Color", 1, 1, 1.0),
+    ("点缀元素", "Accent", 1, 1, 0.6),   # 混沌参数：60% 概率出现
+)
+
+SUBJECT_SLOT = "Subject"
+
+# 有用户输入时，额外再加一个仓库主体的概率
+USER_EXTRA_SUBJECT_PROB = 0.4
+
+# 判断“是否重复”只看这几个维度的组合 (动作 / 氛围不同不算新方案)
+NOVELTY_SLOTS = ("StyleSystem", "Subject", "Technique", "Color")
+
+# 重复的骨架最多重抽几轮；还重复说明词库组合快用光了，直接放行
+NOVELTY_ROUNDS = 8
+
+
+# ==========================================
+# 2. 向量化抽样
+# ==========================================
+_ENCODED = {}   # 分类 -> (分类对象, 词表版本, 权重版本, 词表数组, 别名表)
+
+
+def encode_category(db, cat, weights=None):
+    """
+    分类 -> (词表数组, 别名表)。
+    按分类缓存：只有这个分类的词或权重变了才重建，其余分类原样复用。
+    """
+    weights = weights or get_weight_store()
+    # 存分类对象本身并用 is 比较：重新加载后的新对象哪怕 id 和 version 都撞上也会重建
+    items = db.get(cat)
+    version, weight_version = getattr(items, "version", None), weights.version(cat)
+    cached = _ENCODED.get(cat)
+    if (cached and cached[0] is items and version is not None
+            and cached[1:3] == (version, weight_version)):
+        return cached[3], cached[4]
+    vocab = np.array(list(items or []), dtype=object)
+    table = AliasTable(weights.weights_for(cat, vocab))
+    _ENCODED[cat] = (items, version, weight_version, vocab, table)
+    return vocab, table
+
+
+class SkeletonSampler:
+    """
+    把每个分类预编码成 numpy 字符串数组 + 别名表，一次调用抽 N 套骨架。
+    每次抽样按词条权重进行 (反馈越好的词越常出现)，单次抽样 O(1)。
+    draw() 只做整数运算；render() 再把下标拼成文字。
+    """
+
+    def __init__(self, db, recipe=RECIPE, weights=None):
+        self.recipe = recipe
+        self.vocab = {}
+        self.tables = {}
+        for _, cat, _, _, _ in recipe:
+            self.vocab[cat], self.tables[cat] = encode_category(db, cat, weights)
+        self._label_cache = {}
+
+    def draw(self, n, user_input="", rng=None):
+        """
+        返回 {分类: (n, k) 下标数组，-1 表示该位置为空}
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        user_input = user_input.strip()
+        picks = {}
+        for _, cat, lo, hi, prob in self.recipe:
+            size = len(self.vocab[cat])
+            if cat == SUBJECT_SLOT and user_input:
+                # 用户输入占第一个主体，仓库主体只按概率补一个
+                lo, hi, prob = 1, 1, USER_EXTRA_SUBJECT_PROB
+            if size == 0:
+                picks[cat] = np.full((n, 1), -1, dtype=np.int64)
+                continue
+
+            idx = weighted_distinct_picks(rng, self.tables[cat], n, hi)
+            counts = rng.integers(lo, hi + 1, size=n) if hi > lo else np.full(n, hi)
+            counts = np.minimum(counts, size)
+            present = rng.random(n) < prob if prob < 1.0 else np.ones(n, dtype=bool)
+            mask = (np.arange(idx.shape[1])[None, :] < counts[:, None]) & present[:, None]
+            picks[cat] = np.where(mask, idx, -1)
+        return picks
+
+    def _labeled(self, cat, template):
+        """预先拼好带标签的词表，末尾多放一个空串，正好让下标 -1 取到空"""
+        key = (cat, template)
+        if key not in self._label_cache:
+            words = [template.format(w) for w in self.vocab[cat]] + [""]
+            self._label_cache[key] = np.array(words, dtype=object)
+        return self._label_cache[key]
+
+    def render(self, picks, user_input=""):
+        """下标 -> [(raw_chain, subjects)]，格式与原 assemble_weighted_skeleton 相同"""
+        user_input = user_input.strip()
+        n = len(next(iter(picks.values()))) if picks else 0
+        chain = np.full(n, "", dtype=object)
+        seen_subject = False
+        for label, cat, _, _, _ in self.recipe:
+            idx = picks[cat]
+            if cat == SUBJECT_SLOT:
+                # 主体槽位永远存在，前后的槽位分别把分隔符挂在自己身上
+                head = f"{label}：{user_input}" if user_input else f"{label}："
+                part = np.full(n, head, dtype=object)
+                for c in range(idx.shape[1]):
+                    template = "{}" if (c == 0 and not user_input) else " + {}"
+                    part = part + self._labeled(cat, template)[idx[:, c]]
+                seen_subject = True
+            elif seen_subject:
+                part = self._labeled(cat, f" | {label}：{{}}")[idx[:, 0]]
+            else:
+                part = self._labeled(cat, f"{label}：{{}} | ")[idx[:, 0]]
+            chain = chain + part
+
+        subject_words = self._labeled(SUBJECT_SLOT, "{}")
+        sub_idx = picks[SUBJECT_SLOT].tolist()
+        prefix = [user_input] if user_input else []
+        subjects = [prefix + [subject_words[j] for j in row if j >= 0] for row in sub_idx]
+        return list(zip(chain.tolist(), subjects))
+
+    def terms(self, picks):
+        """每套骨架用到的仓库词 [{分类: [词]}]，用于记录反馈"""
+        n = len(next(iter(picks.values()))) if picks else 0
+        rows = [{} for _ in range(n)]
+        for _, cat, _, _, _ in self.recipe:
+            vocab = self.vocab[cat]
+            for row, idx in zip(rows, picks[cat].tolist()):
+                words = [vocab[j] for j in idx if j >= 0]
+                if words:
+                    row[cat] = words
+        return rows
+
+    def combo_keys(self, picks, user_input=""):
+        """每套骨架在 NOVELTY_SLOTS 上的组合 key (多个主体不分先后)"""
+        n = len(next(iter(picks.values()))) if picks else 0
+        key = np.full(n, user_input.strip(), dtype=object)
+        for cat in NOVELTY_SLOTS:
+            words = self._labeled(cat, "{}")
+            idx = picks[cat]
+            if idx.shape[1] == 2:
+                a, b = words[idx[:, 0]], words[idx[:, 1]]
+                swap = np.array([x > y for x, y in zip(a.tolist(), b.tolist())], dtype=bool)
+                a, b = np.where(swap, b, a), np.where(swap, a, b)
+                part = a + "+" + b
+            else:
+                part = words[idx[:, 0]]
+            key = key + "\x1f" + part
+        return key.tolist()
+
+    def draw_novel(self, n, novelty, user_input="", rng=None, max_rounds=NOVELTY_ROUNDS):
+        """
+        与 draw() 相同，但保证组合没在本批次和历史里出现过：
+        命中布隆过滤器或本批已有的行整行重抽，最后把整批组合记入过滤器
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        picks = self.draw(n, user_input, rng)
+        keys = self.combo_keys(picks, user_input)
+
+        accepted = set()
+        todo = np.arange(n)
+        checked = rejected = 0
+        for _ in range(max_rounds):
+            todo_keys = [keys[i] for i in todo]
+            in_history = novelty.seen(*hash_keys(todo_keys))
+            retry = []
+            for i, key, old in zip(todo.tolist(), todo_keys, in_history.tolist()):
+                if old or key in accepted:
+                    retry.append(i)
+                else:
+                    accepted.add(key)
+            checked += len(todo_keys)
+            rejected += len(retry)
+            if not retry:
+                todo = np.arange(0)
+                break
+            todo = np.array(retry)
+            fresh = self.draw(len(todo), user_input, rng)
+            for cat in picks:
+                picks[cat][todo] = fresh[cat]
+            for i, key in zip(todo.tolist(), self.combo_keys(fresh, user_input)):
+                keys[i] = key
+
+        novelty.record(checked, rejected, exhausted=len(todo))
+        novelty.add(*hash_keys(keys))
+        return picks
+
+    def sample(self, n, user_input="", rng=None):
+        return self.render(self.draw(n, user_input, rng), user_input)
+
+
+def get_sampler(db, recipe=RECIPE):
+    """词表和别名表按分类缓存，构造采样器本身几乎没有开销"""
+    return SkeletonSampler(db, recipe)
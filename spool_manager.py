@@ -0,0 +1,77 @@
+import itertools
+import os
+import time
+import uuid
+
+from warehouse_manager import CACHE_DIR
+
+# ==========================================
+# 1. Prompt 暂存文件 (大批量结果不进 session_state)
+# ==========================================
+# 一行一条 Prompt；session_state 里只记 {"path", "total", "taken"}，
+# Automation 页面按需从文件里一段一段取进队列
+SPOOL_DIR = os.path.join(CACHE_DIR, "spool")
+
+# 超过这么久没人动的暂存文件，下次新建时顺手清掉
+SPOOL_MAX_AGE = 24 * 3600
+
+
+def _cleanup(now=None):
+    now = now or time.time()
+    try:
+        entries = list(os.scandir(SPOOL_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if now - entry.stat().st_mtime > SPOOL_MAX_AGE:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def write_spool(chunks, prefix="prompts"):
+    """
+    chunks: 逐块产出的 Prompt 列表 (生成器即可，边生成边写)。
+    -> {"path", "total", "taken"}，可以直接放进 session_state
+    """
+    _cleanup()
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.txt")
+    tmp_path = path + ".tmp"
+    total = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for prompts in chunks:
+            # Prompt 里的换行压成空格，保证一行一条
+            f.write("".join(p.replace("\n", " ") + "\n" for p in prompts))
+            total += len(prompts)
+    os.replace(tmp_path, path)
+    return {"path": path, "total": total, "taken": 0}
+
+
+def read_spool(spool, limit, start=None):
+    """从 start (默认是已取走的位置) 开始读最多 limit 条；文件没了返回 []"""
+    start = spool["taken"] if start is None else start
+    try:
+        with open(spool["path"], "r", encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in itertools.islice(f, start, start + limit)]
+    except OSError:
+        return []
+
+
+def take_spool(spool, limit):
+    """取出下一段并推进 taken"""
+    prompts = read_spool(spool, limit)
+    spool["taken"] += len(prompts)
+    return prompts
+
+
+def remaining(spool):
+    return max(spool["total"] - spool["taken"], 0) if os.path.exists(spool["path"]) else 0
+
+
+def discard_spool(spool):
+    try:
+        os.remove(spool["path"])
+    except OSError:
+        pass
@@ -0,0 +1,134 @@
+"""
+本地 OpenAI 兼容桩服务 (离线测试用，不花 API 钱)
+
+    python stub_server.py --port 8765 --latency 0.05
+
+然后在 .streamlit/secrets.toml 里设置 DEEPSEEK_BASE_URL = "http://127.0.0.1:8765"
+回复完全由请求内容决定 (同样的输入永远得到同样的输出)。
+"""
+import argparse
+import hashlib
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==========================================
+# 1. 确定性回复
+# ==========================================
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def fake_reply(messages):
+    """按 Prompt 类型给出格式正确的假回复"""
+    prompt = messages[-1]["content"] if messages else ""
+
+    # Smart Ingest：把输入按标点切开，全部当成 Subject
+    m = re.search(r"输入文本：(.*)", prompt, re.S)
+    if m:
+        words = [w for w in re.split(r"[\s,，。;；、]+", m.group(1).strip()) if w]
+        return json.dumps({"Subject": words[:8]}, ensure_ascii=False)
+
+    # Graphic Lab 批量润色：每行 "方案N：骨架" -> JSON 字符串数组
+    if "【批量骨架】" in prompt:
+        items = re.findall(r"^方案(\d+)：(.*)$", prompt, re.M)
+        return json.dumps([f"**方案{idx}：** 微型纹身，{sk.strip()}。(stub {_digest(sk)[:8]})"
+                           for idx, sk in items], ensure_ascii=False)
+
+    # Graphic Lab 润色：保留方案编号和骨架
+    m = re.search(r"\*\*方案(\d+)：\*\*", prompt)
+    sk = re.search(r"【原始关键词骨架】：(.*)", prompt)
+    idx = m.group(1) if m else "1"
+    skeleton = sk.group(1).strip() if sk else prompt[:40]
+    return f"**方案{idx}：** 微型纹身，{skeleton}。(stub {_digest(prompt)[:8]})"
+
+
+def _usage(messages, reply):
+    prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 2
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply) // 2,
+            "total_tokens": prompt_tokens + len(reply) // 2}
+
+
+# ==========================================
+# 2. HTTP 处理
+# ==========================================
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_every = 0
+    counter = 0
+
+    def _send_json(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        # 每 N 个请求返回一次 429，用于测试重试 / 限流逻辑
+        type(self).counter += 1
+        if self.fail_every and type(self).counter % self.fail_every == 0:
+            self._send_json(429, {"error": {"message": "rate limited (stub)", "type": "rate_limit"}})
+            return
+
+        messages = req.get("messages", [])
+        model = req.get("model", "stub")
+        reply = fake_reply(messages)
+        time.sleep(self.latency)
+
+        base = {"id": "stub-" + _digest(reply)[:12], "created": int(time.time()), "model": model}
+        if not req.get("stream"):
+            self._send_json(200, dict(
+                base, object="chat.completion",
+                choices=[{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                usage=_usage(messages, reply)
+            ))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send(chunk):
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i in range(0, len(reply), 8):
+            send(dict(base, object="chat.completion.chunk",
+                      choices=[{"index": 0, "delta": {"content": reply[i:i + 8]}, "finish_reason": None}]))
+            time.sleep(self.latency / 10)
+        send(dict(base, object="chat.completion.chunk",
+                  choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (req.get("stream_options") or {}).get("include_usage"):
+            send(dict(base, object="chat.completion.chunk", choices=[], usage=_usage(messages, reply)))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟延迟 (秒)")
+    parser.add_argument("--fail-every", type=int, default=0, help="每 N 个请求返回一次 429")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.fail_every = args.fail_every
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub server on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+
+from warehouse_manager import CACHE_DIR, load_warehouse
+
+# ==========================================
+# 1. 工具函数
+# ==========================================
+# 远端目录树缓存有效期 (秒)，过期后下一次推送前重新拉取一次
+TREE_TTL = 300
+
+SEARCH_DIRS = ("data/graphic", "data/text", "data/common")
+
+
+def git_blob_sha(content):
+    """与 git hash-object 相同的 blob sha，用来在本地判断内容是否有变化"""
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def render_content(items):
+    """分类 -> 文件内容 (与本地 txt 格式一致)"""
+    return "\n".join(str(x).strip() for x in items if str(x).strip())
+
+
+def match_remote_path(category, local_path, remote_paths):
+    """在远端文件列表里找分类对应的真实路径 (自动匹配 styles_ 等前缀)"""
+    if local_path and local_path in remote_paths:
+        return local_path
+
+    clean_cat = category.strip().lower()
+    candidates = [
+        f"{clean_cat}.txt",
+        f"styles_{clean_cat}.txt",
+        f"{clean_cat}s.txt",
+        f"styles_{clean_cat}s.txt",
+        f"text_{clean_cat}.txt"
+    ]
+    for d in SEARCH_DIRS:
+        for path in remote_paths:
+            folder, _, name = path.rpartition("/")
+            if folder == d and name.lower() in candidates:
+                return path
+    # 默认路径
+    return local_path or f"data/graphic/{category}.txt"
+
+
+# ==========================================
+# 2. 后端：GitHub API / 本地裸仓库
+# ==========================================
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_github_client(token):
+    """同一个 token 在进程内只建一个 Github 客户端 (复用连接池)"""
+    with _CLIENTS_LOCK:
+        if token not in _CLIENTS:
+            from github import Github
+            _CLIENTS[token] = Github(token, per_page=100)
+        return _CLIENTS[token]
+
+
+class GitHubBackend:
+    """用 Git Data API 把多个文件合成一个 commit"""
+
+    def __init__(self, token, repo_name, branch="main"):
+        self.token = token
+        self.repo_name = repo_name
+        self.branch = branch
+        self._repo = None
+
+    @property
+    def repo(self):
+        # 第一次真正同步时才连 GitHub，渲染侧边栏状态不产生网络请求
+        if self._repo is None:
+            self._repo = get_github_client(self.token).get_repo(self.repo_name)
+        return self._repo
+
+    def list_files(self):
+        """一次递归拉取整个目录树：{path: blob_sha}"""
+        ref = self.repo.get_git_ref(f"heads/{self.branch}")
+        tree = self.repo.get_git_tree(ref.object.sha, recursive=True)
+        return {item.path: item.sha for item in tree.tree if item.type == "blob"}
+
+    def commit_files(self, files, message):
+        from github import InputGitTreeElement
+
+        ref = self.repo.get_git_ref(f"heads/{self.branch}")
+        base_commit = self.repo.get_git_commit(ref.object.sha)
+        elements = [
+            InputGitTreeElement(path=path, mode="100644", type="blob", content=content)
+            for path, content in files.items()
+        ]
+        tree = self.repo.create_git_tree(elements, base_tree=base_commit.tree)
+        commit = self.repo.create_git_commit(message, tree, [base_commit])
+        ref.edit(commit.sha)
+        return commit.sha
+
+
+class LocalGitBackend:
+    """对本地 (裸) 仓库做同样的事，方便离线测试，不需要 GitHub"""
+
+    def __init__(self, git_dir, branch="main"):
+        self.git_dir = git_dir
+        self.branch = branch
+
+    def _git(self, *args, stdin=None, env=None):
+        full_env = dict(os.environ, **(env or {}))
+        full_env.setdefault("GIT_AUTHOR_NAME", "Tattoo Engine")
+        full_env.setdefault("GIT_AUTHOR_EMAIL", "engine@localhost")
+        full_env.setdefault("GIT_COMMITTER_NAME", full_env["GIT_AUTHOR_NAME"])
+        full_env.setdefault("GIT_COMMITTER_EMAIL", full_env["GIT_AUTHOR_EMAIL"])
+        res = subprocess.run(
+            ["git", f"--git-dir={self.git_dir}", *args],
+            input=stdin, capture_output=True, env=full_env, check=True
+        )
+        return res.stdout.decode("utf-8").strip()
+
+    def _head(self):
+        try:
+            return self._git("rev-parse", "--verify", f"refs/heads/{self.branch}")
+        except subprocess.CalledProcessError:
+            return None
+
+    def list_files(self):
+        head = self._head()
+        if not head:
+            return {}
+        files = {}
+        for line in self._git("ls-tree", "-r", head).splitlines():
+            meta, _, path = line.partition("\t")
+            _mode, obj_type, sha = meta.split()
+            if obj_type == "blob":
+                files[path] = sha
+        return files
+
+    def commit_files(self, files, message):
+        head = self._head()
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {"GIT_INDEX_FILE": os.path.join(tmp, "index")}
+            if head:
+                self._git("read-tree", head, env=env)
+            for path, content in files.items():
+                sha = self._git("hash-object", "-w", "--stdin", stdin=content.encode("utf-8"))
+                self._git("update-index", "--add", "--cacheinfo", f"100644,{sha},{path}", env=env)
+            tree = self._git("write-tree", env=env)
+        parents = ["-p", head] if head else []
+        commit = self._git("commit-tree", tree, *parents, "-m", message)
+        # 带上旧值做 CAS，别人抢先推送时会失败而不是覆盖
+        self._git("update-ref", f"refs/heads/{self.branch}", commit, head or "")
+        return commit
+
+
+# ==========================================
+# 3. 同步引擎：缓存路径映射 + blob sha，多分类一次提交
+# ==========================================
+class WarehouseSync:
+    def __init__(self, backend, warehouse):
+        self.backend = backend
+        self.warehouse = warehouse
+        self.lock = threading.Lock()
+        self.remote_files = {}    # 远端 path -> blob sha
+        self.path_map = {}        # 分类 -> 远端 path
+        self.tree_time = 0.0
+
+    def _refresh_tree(self, force=False):
+        if force or not self.remote_files or time.monotonic() - self.tree_time > TREE_TTL:
+            self.remote_files = self.backend.list_files()
+            self.path_map = {}
+            self.tree_time = time.monotonic()
+
+    def remote_path(self, category):
+        if category not in self.path_map:
+            self.path_map[category] = match_remote_path(
+                category, self.warehouse.get(category), self.remote_files
+            )
+        return self.path_map[category]
+
+    def push(self, categories, message=None):
+        """
+        categories: {分类: 词条列表}
+        只上传内容真的变了的分类，全部合并成一个 commit。
+        返回 {"commit": sha 或 None, "files": [已上传的路径]}
+        """
+        with self.lock:
+            for attempt in range(2):
+                self._refresh_tree(force=attempt > 0)
+                changed = {}
+                changed_cats = []
+                for cat, items in categories.items():
+                    path = self.remote_path(cat)
+                    content = render_content(items)
+                    if self.remote_files.get(path) != git_blob_sha(content):
+                        changed[path] = content
+                        changed_cats.append(cat)
+
+                if not changed:
+                    return {"commit": None, "files": []}
+
+                names = ", ".join(sorted(changed_cats))
+                try:
+                    sha = self.backend.commit_files(changed, message or f"Update {names} via App")
+                except Exception:
+                    # 远端分支被别人改过：刷新目录树后重试一次
+                    if attempt:
+                        raise
+                    continue
+
+                for path, content in changed.items():
+                    self.remote_files[path] = git_blob_sha(content)
+                return {"commit": sha, "files": sorted(changed)}
+
+
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_sync_engine(warehouse, token=None, repo_name=None, branch="main", local_repo=None):
+    """
+    进程级复用同步引擎。
+    配置了 local_repo 时走本地裸仓库 (测试用)，否则走 GitHub API。
+    """
+    key = (local_repo or repo_name, branch)
+    with _ENGINES_LOCK:
+        if key not in _ENGINES:
+            if local_repo:
+                backend = LocalGitBackend(local_repo, branch)
+            else:
+                backend = GitHubBackend(token, repo_name, branch)
+            _ENGINES[key] = WarehouseSync(backend, warehouse)
+        return _ENGINES[key]
+
+
+# ==========================================
+# 4. 后台写回队列 (Write-Behind)
+# ==========================================
+# 最后一次编辑后静默多久再上传；连续编辑最多攒这么久也会强制上传
+DEBOUNCE = 2.0
+MAX_DELAY = 15.0
+RETRY_BASE = 2.0
+RETRY_MAX = 300.0
+
+PENDING_FILE = os.path.join(CACHE_DIR, "sync_pending.json")
+
+
+class SyncQueue:
+    """
+    UI 只负责登记“哪些分类脏了”，上传由后台线程完成：
+    同一分类的连续编辑合并成一次上传，失败按指数退避 + 抖动重试，
+    待同步分类持久化到磁盘，进程重启后继续。
+    上传的内容是上传那一刻共享仓库里的最新版本，所以只需要记分类名。
+    """
+
+    def __init__(self, engine, state_path=PENDING_FILE):
+        self.engine = engine
+        self.state_path = state_path
+        self.cond = threading.Condition()
+        self.pending = set()
+        self.first_dirty = 0.0
+        self.last_dirty = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.status = {"state": "idle", "last_sync": None, "last_error": None, "last_commit": None}
+        self._load_pending()
+        self.thread = threading.Thread(target=self._run, name="warehouse-sync", daemon=True)
+        self.thread.start()
+
+    # --- 持久化 ---
+    def _load_pending(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.pending = set(json.load(f).get("pending", []))
+        except (OSError, ValueError):
+            self.pending = set()
+        if self.pending:
+            self.first_dirty = self.last_dirty = time.monotonic()
+            self.status["state"] = "pending"
+
+    def _save_pending(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pending": sorted(self.pending)}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    # --- 对外接口 ---
+    def enqueue(self, categories):
+        """登记需要同步的分类，立即返回"""
+        with self.cond:
+            now = time.monotonic()
+            if not self.pending:
+                self.first_dirty = now
+            self.last_dirty = now
+            self.pending.update(categories)
+            self._save_pending()
+            if self.status["state"] in ("idle", "synced"):
+                self.status["state"] = "pending"
+            self.cond.notify()
+
+    def snapshot(self):
+        with self.cond:
+            return dict(self.status, pending=len(self.pending), failures=self.failures)
+
+    # --- 后台线程 ---
+    def _ready_in(self, now):
+        """距离可以上传还要等多久 (秒)；None 表示无事可做"""
+        if not self.pending:
+            return None
+        due = min(self.last_dirty + DEBOUNCE, self.first_dirty + MAX_DELAY)
+        return max(due, self.retry_at) - now
+
+    def _run(self):
+        while True:
+            with self.cond:
+                wait = self._ready_in(time.monotonic())
+                while wait is None or wait > 0:
+                    self.cond.wait(timeout=wait)
+                    wait = self._ready_in(time.monotonic())
+                batch, self.pending = self.pending, set()
+                self.status["state"] = "syncing"
+
+            try:
+                payload = load_warehouse({c: self.engine.warehouse[c] for c in batch if c in self.engine.warehouse})
+                result = self.engine.push(payload)
+            except Exception as e:
+                with self.cond:
+                    # 失败的分类放回队列，指数退避 + 抖动
+                    self.pending |= batch
+                    self.failures += 1
+                    delay = min(RETRY_BASE * 2 ** (self.failures - 1), RETRY_MAX)
+                    self.retry_at = time.monotonic() + delay * random.uniform(0.5, 1.0)
+                    self.status.update(state="retrying", last_error=f"{type(e).__name__}: {e}")
+                    self._save_pending()
+                continue
+
+            with self.cond:
+                self.failures = 0
+                self.retry_at = 0.0
+                if self.pending:
+                    self.first_dirty = time.monotonic()
+                self.status.update(
+                    state="pending" if self.pending else "synced",
+                    last_sync=time.time(), last_error=None,
+                    last_commit=result["commit"] or self.status["last_commit"]
+                )
+                self._save_pending()
+
+
+_QUEUES = {}
+
+
+def get_sync_queue(warehouse, token=None, repo_name=None, branch="main", local_repo=None):
+    """进程级单例：每个目标仓库/分支一个后台同步线程"""
+    engine = get_sync_engine(warehouse, token=token, repo_name=repo_name, branch=branch, local_repo=local_repo)
+    with _ENGINES_LOCK:
+        key = id(engine)
+        if key not in _QUEUES:
+            _QUEUES[key] = SyncQueue(engine)
+        return _QUEUES[key]
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from warehouse_manager import BASE_DIR, CHECK_INTERVAL, file_signature
+
+# ==========================================
+# 1. 文字词库 (data/text 下文件名含 text_ 的文件)
+# ==========================================
+TEXT_DIR = os.path.join(BASE_DIR, "data", "text")
+
+# 词库为空时的占位符，不参与随机抽词
+PLACEHOLDER_WORDS = ("(Empty)", "(Empty File)")
+
+# 依次尝试的编码；识别出来后记在文件上，下次直接用
+ENCODINGS = ("utf-8", "gbk")
+
+# 写词库时的附属文件 (锁、日志、原子写的临时文件)，不是词库
+SIDE_SUFFIXES = (".lock", ".journal", ".tmp")
+
+
+def _is_bank_file(name):
+    return "text_" in name and not name.endswith(SIDE_SUFFIXES)
+
+
+def read_text_file(full_path, encoding=None):
+    """
+    按行读取 -> (词元组, 实际编码)；都解不开返回 (None, None)
+    encoding 给定时先试它 (上次识别出的编码)，不对再按 ENCODINGS 顺序试
+    """
+    with open(full_path, "rb") as f:
+        raw = f.read()
+    order = (encoding,) + tuple(e for e in ENCODINGS if e != encoding) if encoding else ENCODINGS
+    for enc in order:
+        try:
+            content = raw.decode(enc)
+        except UnicodeDecodeError:
+            continue
+        # 按行切割，去除首尾空格，过滤空行
+        return tuple(line.strip() for line in content.splitlines() if line.strip()), enc
+    return None, None
+
+
+_BANKS = {}   # 目录 -> {"checked", "dir_sig", "names", "files": {文件名: (指纹, 编码, 词)}, "view"}
+_BANKS_LOCK = threading.Lock()
+
+
+def _scan_bank(entry, data_path):
+    """只重读指纹变了的文件；什么都没变时保留原来的 view 对象"""
+    dir_sig = file_signature(data_path)
+    if dir_sig is None:
+        # 目录不存在：清掉缓存，下次调用重新看，目录补上后就能读到
+        entry.update(dir_sig=None, names=[], files={}, view=None)
+        raise FileNotFoundError(data_path)
+    if dir_sig != entry.get("dir_sig"):
+        # 目录 mtime 变了 (增删 / 改名文件) 才重新列目录
+        entry["names"] = sorted(f for f in os.listdir(data_path) if _is_bank_file(f))
+        entry["dir_sig"] = dir_sig
+
+    files = {}
+    changed = set(entry["files"]) != set(entry["names"])
+    for name in entry["names"]:
+        path = os.path.join(data_path, name)
+        sig = file_signature(path)
+        cached = entry["files"].get(name)
+        if cached and cached[0] == sig:
+            files[name] = cached
+            continue
+        changed = True
+        words, encoding = read_text_file(path, cached[1] if cached else None)
+        if words is not None:
+            files[name] = (sig, encoding, words)
+    entry["files"] = files
+    if changed or entry.get("view") is None:
+        entry["view"] = {name: f[2] for name, f in files.items()}
+
+
+def load_text_bank(data_path=TEXT_DIR, force=False):
+    """
+    {文件名: (词, ...)}，进程级共享、只读。
+    只要文件名包含 text_ 就读，不管有没有 .txt 后缀 (锁 / 日志 / 临时文件除外)；目录不存在时抛 FileNotFoundError。
+    最多每 CHECK_INTERVAL 秒看一次文件指纹；期间的 rerun 完全不碰硬盘
+    """
+    with _BANKS_LOCK:
+        entry = _BANKS.setdefault(data_path, {"checked": 0.0, "files": {}, "names": [], "view": None})
+        now = time.monotonic()
+        if force or entry["view"] is None or now - entry["checked"] >= CHECK_INTERVAL:
+            _scan_bank(entry, data_path)
+            entry["checked"] = now
+        return entry["view"]
+
+
+# ==========================================
+# 2. Prompt 构造 (去风格 + 纯净 Prompt)
+# ==========================================
+GITHUB_RAW_BASE = "https://raw.githubusercontent.com/losran/Tattoo_Engine_V2/main/images/"
+
+
+def image_url(img_val):
+    return f"{GITHUB_RAW_BASE}{urllib.parse.quote(img_val)}" if img_val else ""
+
+
+# Prompt = 前缀 + 图片段 + 单词段 + 参数段；批量生成时每张图 / 每个词的片段只拼一次
+def _image_part(img_val):
+    full_img_url = image_url(img_val)
+    return f"{full_img_url} " if full_img_url else ""
+
+
+def _word_part(word):
+    return f"Tattoo design of the word '{word}', clean white background, high contrast "
+
+
+def _param_part(ar=None):
+    return f"--ar {ar} --iw 2 **" if ar else "--iw 2 **"
+
+
+def build_text_prompt(idx, word, img_val="", ar=None):
+    """ar: 参考图的宽高比 (如 "4:5")，给了就加 --ar 让出图比例跟参考图一致"""
+    prefix = f"**方案{idx}：** "
+    return f"{prefix}{_image_part(img_val)}{_word_part(word)}{_param_part(ar)}"
+
+
+# ==========================================
+# 3. 批量生成 (下标数组抽样，分块产出)
+# ==========================================
+# 词 × 图的配对方式
+PAIR_MODES = ("replace", "unique", "cartesian")
+PROMPT_CHUNK = 4096
+
+
+def draw_pairs(n_words, n_images, count, mode="replace", rng=None, chunk=PROMPT_CHUNK):
+    """
+    逐块产出 (词下标数组, 图下标数组)：
+    replace   = 有放回随机抽 count 对；
+    unique    = 不重复的 count 对 (超过词数 × 图数时截到全部组合)；
+    cartesian = 按顺序走遍词 × 图的全部组合，最多 count 对
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    total_pairs = n_words * n_images
+    if mode == "replace":
+        for start in range(0, count, chunk):
+            size = min(chunk, count - start)
+            yield rng.integers(n_words, size=size), rng.integers(n_images, size=size)
+        return
+    if mode not in PAIR_MODES:
+        raise ValueError(f"unknown pair mode: {mode}")
+
+    total = min(count, total_pairs)
+    # unique 只为要的那些对分配内存 (numpy 在抽得少时不会生成整个排列)
+    flat = rng.choice(total_pairs, size=total, replace=False) if mode == "unique" else None
+    for start in range(0, total, chunk):
+        stop = min(start + chunk, total)
+        idx = flat[start:stop] if flat is not None else np.arange(start, stop)
+        yield idx // n_images, idx % n_images
+
+
+def iter_text_prompts(words, images, count, mode="replace", rng=None, ars=None, start=1, chunk=PROMPT_CHUNK):
+    """
+    逐块产出 [(编号, 词, 图, Prompt), ...]，一次只在内存里放一块。
+    images 为空 = 不带图；ars: {图: 宽高比}，给了就按图加 --ar。
+    图片 URL 在开头 quote 一次，之后只按下标拼字符串
+    """
+    words = list(words)
+    images = list(images) or [""]
+    ars = ars or {}
+    image_parts = [_image_part(img) for img in images]
+    param_parts = [_param_part(ars.get(img)) for img in images]
+    word_parts = [_word_part(w) for w in words]
+
+    n = start
+    for w_idx, i_idx in draw_pairs(len(words), len(images), count, mode, rng, chunk):
+        rows = []
+        for wi, ii in zip(w_idx.tolist(), i_idx.tolist()):
+            rows.append((n, words[wi], images[ii], f"**方案{n}：** {image_parts[ii]}{word_parts[wi]}{param_parts[ii]}"))
+            n += 1
+        yield rows
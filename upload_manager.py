@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import threading
+
+from PIL import Image
+
+from image_manager import HASH_CHUNK, get_image_manifest, submit_image_job, content_hash
+from warehouse_manager import BASE_DIR, CACHE_DIR
+
+# ==========================================
+# 1. 别名表 (上传时的文件名 / 内容哈希 -> 图库里的正本)
+# ==========================================
+# 正本仍然放在 images/<文件名> (Prompt 里的 GitHub raw 链接按文件名引用)；
+# 同一张图不管换了多少个微信文件名，只存一份；别名表是运行期数据，放在 .cache/ 下不进版本库
+ALIAS_FILE = os.path.join(CACHE_DIR, "image_aliases.json")
+
+# 上传先写到这里，算完哈希再决定落盘还是丢弃 (不在 images/ 顶层，清单扫描看不到)
+INCOMING_DIR = os.path.join(BASE_DIR, "images", ".incoming")
+UPLOAD_CHUNK = HASH_CHUNK
+
+# 超过任一上限的原图在后台重新编码
+NORMALIZE_MAX_BYTES = 4 * 1024 * 1024
+NORMALIZE_MAX_SIDE = 2048
+NORMALIZE_JPEG_QUALITY = 90
+
+
+class AliasTable:
+    """
+    names:  上传文件名 -> 内容哈希
+    hashes: 内容哈希 -> 正本文件名 (压缩前后的哈希都指向同一个正本，原图再传一次也能认出来)
+    """
+
+    def __init__(self, path=ALIAS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.names = {}
+        self.hashes = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.names = data.get("names", {})
+            self.hashes = data.get("hashes", {})
+        except (OSError, ValueError):
+            pass
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"names": self.names, "hashes": self.hashes}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def link(self, upload_name, digest, canonical):
+        with self.lock:
+            self.names[upload_name] = digest
+            self.hashes[digest] = canonical
+            self._save_locked()
+
+    def canonical_for(self, digest):
+        with self.lock:
+            return self.hashes.get(digest)
+
+
+_ALIASES = AliasTable()
+
+
+def get_alias_table():
+    return _ALIASES
+
+
+# ==========================================
+# 2. 入库：分块落盘 + 哈希 + 去重
+# ==========================================
+def _unique_name(image_dir, name):
+    """同名但内容不同的图不覆盖，改名为 "xxx (2).png" """
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 2
+    while os.path.exists(os.path.join(image_dir, candidate)):
+        candidate = f"{stem} ({n}){ext}"
+        n += 1
+    return candidate
+
+
+def find_existing(digest):
+    """内容哈希 -> 图库里现存的正本文件名"""
+    manifest = get_image_manifest()
+    canonical = _ALIASES.canonical_for(digest)
+    if canonical and canonical in manifest:
+        return canonical
+    return manifest.name_for_hash(digest)
+
+
+def ingest_upload(fileobj, name):
+    """
+    把上传的文件流入图库，返回 {"status": "saved" | "duplicate", "name": 正本文件名}。
+    重复的图不写入 images/，只记一条别名。
+    """
+    manifest = get_image_manifest()
+    name = os.path.basename(name)
+    os.makedirs(INCOMING_DIR, exist_ok=True)
+    tmp_path = os.path.join(INCOMING_DIR, f"{os.getpid()}-{threading.get_ident()}.part")
+
+    h = hashlib.sha256()
+    with open(tmp_path, "wb") as f:
+        for chunk in iter(lambda: fileobj.read(UPLOAD_CHUNK), b""):
+            h.update(chunk)
+            f.write(chunk)
+    digest = h.hexdigest()
+
+    existing = find_existing(digest)
+    if existing:
+        os.remove(tmp_path)
+        _ALIASES.link(name, digest, existing)
+        return {"status": "duplicate", "name": existing}
+
+    canonical = _unique_name(manifest.image_dir, name)
+    os.replace(tmp_path, manifest.file_path(canonical))
+    _ALIASES.link(name, digest, canonical)
+    manifest.refresh(force=True)
+    schedule_normalize(canonical)
+    return {"status": "saved", "name": canonical}
+
+
+# ==========================================
+# 3. 后台压缩超大原图
+# ==========================================
+def normalize_image(path, max_side=NORMALIZE_MAX_SIDE, max_bytes=NORMALIZE_MAX_BYTES, quality=NORMALIZE_JPEG_QUALITY):
+    """
+    在子进程里跑：长边缩到 max_side 以内并重新编码 (格式随扩展名不变)。
+    结果没有变小就保留原文件；返回是否改写了文件
+    """
+    with Image.open(path) as img:
+        if max(img.size) <= max_side and os.path.getsize(path) <= max_bytes:
+            return False
+        img.load()
+        fmt = img.format
+        img.thumbnail((max_side, max_side))
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+    tmp_path = path + ".tmp"
+    img.save(tmp_path, fmt, optimize=True, quality=quality)
+    if os.path.getsize(tmp_path) >= os.path.getsize(path):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+
+def schedule_normalize(canonical):
+    manifest = get_image_manifest()
+    info = manifest.get(canonical)
+    if not info:
+        return
+    if info["size"] <= NORMALIZE_MAX_BYTES and max(info["width"] or 0, info["height"] or 0) <= NORMALIZE_MAX_SIDE:
+        return
+
+    def done(future):
+        if future.exception() is not None:
+            print(f"Normalize Error: {future.exception()}")
+            return
+        if not future.result():
+            return
+        # 压缩后的新哈希也指向同一个正本；原图的哈希保留，原图再传一次仍判为重复
+        path = manifest.file_path(canonical)
+        _ALIASES.link(canonical, content_hash(path), canonical)
+        manifest.refresh(force=True)
+
+    submit_image_job(normalize_image, manifest.file_path(canonical)).add_done_callback(done)
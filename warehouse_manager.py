@@ -0,0 +1,444 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections.abc import Sequence
+
+try:
+    import fcntl  # 多进程 (App + 命令行脚本) 同时写时加文件锁
+except ImportError:
+    fcntl = None
+
+# ==========================================
+# 1. 分类容器：保持顺序 + 哈希索引
+# ==========================================
+def normalize_key(text):
+    """查重用的归一化 key：全角转半角、合并空白、忽略大小写"""
+    text = unicodedata.normalize("NFKC", str(text))
+    return " ".join(text.split()).casefold()
+
+
+class WarehouseCategory(Sequence):
+    """
+    一个分类的词条集合。
+    按插入顺序迭代/下标访问，按原词精确索引，查重和删除都是 O(1)。
+    归一化 key ("Ｃａｔ"、" cat " 与 "Cat" 视为同一个词) 只用来拒收新录入的近似重复；
+    文件里已有的词原样保留 ("KARMA" 与 "Karma" 都在)，删除也只删写法完全一致的那个。
+    Session 拿到的是共享对象，只读使用；修改统一走 warehouse_manager 的写入函数。
+    """
+
+    def __init__(self, items=()):
+        self._lock = threading.Lock()
+        self._items = {}     # 原词 -> None，dict 本身保持插入顺序
+        self._keys = {}      # 归一化 key -> 库里有几个这种写法
+        self._view = ()
+        self.version = 0     # 每次增删 +1，派生索引 (匹配自动机等) 据此判断是否需要更新
+        for item in items:
+            self.add(item, near_duplicates=True)
+
+    def add(self, value, near_duplicates=False):
+        """
+        新增成功返回 True，空值、含换行 (.txt 一行一个词，存不下) 或已存在返回 False。
+        near_duplicates=True 时只拒收完全相同的原词 (读盘 / 重放日志时用)
+        """
+        value = str(value).strip()
+        key = normalize_key(value)
+        if not key or "\n" in value or "\r" in value:
+            return False
+        with self._lock:
+            if value in self._items or (not near_duplicates and key in self._keys):
+                return False
+            self._items[value] = None
+            self._keys[key] = self._keys.get(key, 0) + 1
+            self._view = None
+            self.version += 1
+            return True
+
+    def discard(self, value):
+        """按原词精确删除并返回它，不存在返回 None"""
+        value = str(value).strip()
+        with self._lock:
+            if value not in self._items:
+                return None
+            del self._items[value]
+            key = normalize_key(value)
+            if self._keys[key] > 1:
+                self._keys[key] -= 1
+            else:
+                del self._keys[key]
+            self._view = None
+            self.version += 1
+            return value
+
+    def as_tuple(self):
+        """当前内容的不可变快照 (有修改时才重建)"""
+        view = self._view
+        if view is None:
+            with self._lock:
+                if self._view is None:
+                    self._view = tuple(self._items)
+                view = self._view
+        return view
+
+    def __contains__(self, value):
+        """按归一化 key 判断 (与 add 的查重口径一致)"""
+        return normalize_key(value) in self._keys
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __getitem__(self, index):
+        return self.as_tuple()[index]
+
+    def __repr__(self):
+        return f"WarehouseCategory({len(self)} items)"
+
+
+# ==========================================
+# 2. 进程级共享仓库 (所有 Session 共用一份)
+# ==========================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 运行期缓存 / 状态文件 (不进 git)
+CACHE_DIR = os.path.join(BASE_DIR, ".cache")
+
+# 写入日志和文件锁放这里，不和词库 .txt 混在 data/ 下 (列目录的代码会把它们当成词库)
+JOURNAL_DIR = os.path.join(CACHE_DIR, "warehouse")
+
+# 文件签名检查的最短间隔 (秒)：间隔内的新 Session / Rerun 完全不碰硬盘
+CHECK_INTERVAL = 2.0
+
+# 日志合并策略：攒够条数立即合并，否则最后一次写入后延迟合并
+COMPACT_THRESHOLD = 200
+COMPACT_DELAY = 5.0
+
+_LOCK = threading.RLock()
+_STORE = {}        # key -> {"path": 绝对路径, "sig": (txt 指纹, 日志指纹), "items": WarehouseCategory, "ops": 日志条数}
+_LAST_CHECK = {"t": 0.0}
+
+
+def resolve_path(path):
+    """相对路径统一以项目根目录为基准，避免受启动目录影响"""
+    return path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+
+
+def _side_path(path, suffix):
+    """词库文件 -> JOURNAL_DIR 下的同名附属文件 (按相对项目根目录的路径命名)"""
+    rel = os.path.relpath(path, BASE_DIR)
+    if rel.startswith(os.pardir):
+        # 项目外的词库：用绝对路径的哈希区分同名文件
+        digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:12]
+        rel = os.path.join("_external", f"{digest}_{os.path.basename(path)}")
+    return os.path.join(JOURNAL_DIR, rel + suffix)
+
+
+def journal_path(path):
+    return _side_path(path, ".journal")
+
+
+def file_signature(path):
+    """mtime + size 作为文件指纹，文件不存在返回 None"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def _category_signature(path):
+    return (file_signature(path), file_signature(journal_path(path)))
+
+
+class _FileLock:
+    """跨进程互斥 (没有 fcntl 的平台上退化为仅进程内加锁)"""
+
+    def __init__(self, path):
+        self.path = _side_path(path, ".lock")
+        self.fd = None
+
+    def __enter__(self):
+        # 日志和锁在同一个目录，这里建好后写日志不用再管
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if fcntl is not None:
+            self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+def _journal_line(op, word):
+    """一行一条操作：op \t JSON 字符串 (词里的制表符、引号等都被转义，不会和分隔符混淆)"""
+    return f"{op}\t{json.dumps(word, ensure_ascii=False)}\n"
+
+
+def _replay_journal(items, path, j_path=None, escaped=True):
+    """
+    把日志里完整的操作重放到 items 上；末尾写了一半的行 (崩溃残留) 会被截掉。
+    调用方必须已经持有 _FileLock(path)：读、截断之间不能有别的进程插进来追加。
+    escaped=False 读旧版放在词库旁边、没转义的日志
+    """
+    j_path = j_path or journal_path(path)
+    try:
+        with open(j_path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            os.truncate(j_path, end)
+    except OSError:
+        return 0
+
+    count = 0
+    for line in data[:end].decode("utf-8", errors="replace").splitlines():
+        op, _, word = line.partition("\t")
+        if escaped:
+            try:
+                word = json.loads(word)
+            except ValueError:
+                continue
+        if op == "+":
+            items.add(word, near_duplicates=True)
+        elif op == "-":
+            items.discard(word)
+        count += 1
+    return count
+
+
+def _read_items(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return WarehouseCategory(f)
+    except (OSError, UnicodeDecodeError):
+        return WarehouseCategory()
+
+
+def _migrate_legacy_journal(items, path):
+    """旧版把日志和锁放在词库旁边：还有没合并的改动就重放后写回 .txt，然后删掉这两个文件"""
+    legacy = path + ".journal"
+    if os.path.exists(legacy):
+        if _replay_journal(items, path, j_path=legacy, escaped=False):
+            _atomic_write(path, items)
+        os.remove(legacy)
+    try:
+        os.remove(path + ".lock")
+    except OSError:
+        pass
+
+
+def _load_entry(key, path, locked=False):
+    """locked=True 表示调用方已经持有这个分类的 _FileLock (flock 不可重入，不能再锁一次)"""
+    full_path = resolve_path(path)
+    if not locked:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with _FileLock(full_path):
+            return _load_entry(key, path, locked=True)
+    # 清理上次崩溃留下的临时文件 (正式文件只会通过 rename 原子替换，所以它一定是完整的)
+    tmp_path = full_path + ".tmp"
+    if os.path.exists(tmp_path):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    items = _read_items(full_path) if os.path.exists(full_path) else WarehouseCategory()
+    _migrate_legacy_journal(items, full_path)
+    ops = _replay_journal(items, full_path) if os.path.exists(journal_path(full_path)) else 0
+    sig = _category_signature(full_path)
+    _STORE[key] = {"path": full_path, "sig": sig, "items": items, "ops": ops}
+    if ops:
+        _COMPACTOR.schedule(key)
+
+
+def _refresh_locked(warehouse, force=False):
+    now = time.monotonic()
+    if not force and now - _LAST_CHECK["t"] < CHECK_INTERVAL:
+        # 只补齐从没加载过的分类
+        for key, path in warehouse.items():
+            if key not in _STORE:
+                _load_entry(key, path)
+        return
+
+    _LAST_CHECK["t"] = now
+    for key, path in warehouse.items():
+        entry = _STORE.get(key)
+        if entry is None or entry["path"] != resolve_path(path):
+            _load_entry(key, path)
+        elif _category_signature(entry["path"]) != entry["sig"]:
+            # 文件被外部修改 (git pull / 手动编辑 / 其他进程写日志)，只重读这一个分类
+            _load_entry(key, path)
+
+
+def _ensure_loaded(key, path):
+    entry = _STORE.get(key)
+    if entry is None or entry["path"] != resolve_path(path):
+        _load_entry(key, path)
+    elif _category_signature(entry["path"]) != entry["sig"]:
+        _load_entry(key, path)
+    return _STORE[key]
+
+
+def load_warehouse(warehouse, force=False):
+    """
+    返回 {分类: 只读视图}。
+    视图是进程内共享的同一个对象，Session 之间不会各自复制一份词库。
+    """
+    with _LOCK:
+        _refresh_locked(warehouse, force)
+        return {key: _STORE[key]["items"] for key in warehouse}
+
+
+def get_category(key):
+    with _LOCK:
+        entry = _STORE.get(key)
+        return entry["items"] if entry else WarehouseCategory()
+
+
+# ==========================================
+# 3. 写入：追加日志 + 后台合并
+# ==========================================
+def _atomic_write(path, items):
+    """写临时文件 -> fsync -> rename，任何时刻磁盘上的正式文件都是完整的"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(items))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _edit(key, path, apply):
+    """
+    在文件锁内：先确认磁盘没被别的进程改过 (改过就重读)，再改内存、追加日志。
+    apply(items) 改动 items 并返回要写入日志的行；单次编辑的 I/O 与分类大小无关
+    """
+    entry = _ensure_loaded(key, path)
+    full_path = entry["path"]
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with _FileLock(full_path):
+        if _category_signature(full_path) != entry["sig"]:
+            # 检查和加锁之间别的进程追加过日志：先把它们的改动读进来，不能算到自己头上
+            _load_entry(key, path, locked=True)
+            entry = _STORE[key]
+        lines = apply(entry["items"])
+        if lines:
+            with open(journal_path(full_path), "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            entry["ops"] += len(lines)
+            # 锁还在手里，此刻的指纹只包含自己写的日志，不应触发重读
+            entry["sig"] = _category_signature(full_path)
+    if lines:
+        _COMPACTOR.schedule(key, urgent=entry["ops"] >= COMPACT_THRESHOLD)
+    return lines
+
+
+def _compact_locked(key):
+    """把内存里的最新内容原子写回 .txt，然后清空日志"""
+    entry = _STORE.get(key)
+    if entry is None or not entry["ops"]:
+        return
+    path = entry["path"]
+    with _FileLock(path):
+        if _category_signature(path) != entry["sig"]:
+            # 其他进程在这期间写过，先重放它们的改动再合并
+            _load_entry(key, path, locked=True)
+            entry = _STORE[key]
+        _atomic_write(path, entry["items"])
+        # 若在 rename 之后、清空日志之前崩溃，重放日志是幂等的，结果不变
+        open(journal_path(path), "w").close()
+    entry["ops"] = 0
+    entry["sig"] = _category_signature(path)
+
+
+class _Compactor:
+    """后台合并线程：攒一小段时间的编辑，一次性重写 .txt"""
+
+    def __init__(self):
+        self._pending = set()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def schedule(self, key, urgent=False):
+        self._pending.add(key)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="warehouse-compactor", daemon=True)
+            self._thread.start()
+        if urgent:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(COMPACT_DELAY)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with _LOCK:
+            keys, self._pending = self._pending, set()
+            for key in keys:
+                try:
+                    _compact_locked(key)
+                except OSError as e:
+                    print(f"Compact Error ({key}): {e}")
+                    self._pending.add(key)
+
+
+_COMPACTOR = _Compactor()
+
+
+def flush_journals():
+    """立即合并所有待处理的日志 (退出进程时自动调用)"""
+    _COMPACTOR.flush()
+
+
+atexit.register(flush_journals)
+
+
+def replace_category(key, path, new_items):
+    """整体替换一个分类 (去空、去首尾空格、去重、保持顺序)"""
+    items = WarehouseCategory(new_items)
+    with _LOCK:
+        full_path = resolve_path(path)
+        with _FileLock(full_path):
+            _atomic_write(full_path, items)
+            open(journal_path(full_path), "w").close()
+        _STORE[key] = {"path": full_path, "sig": _category_signature(full_path), "items": items, "ops": 0}
+        return items
+
+
+def add_items(key, path, values):
+    """追加新词，已存在的跳过；返回真正新增的词"""
+    added = []
+
+    def apply(items):
+        added.extend(str(v).strip() for v in values if items.add(v))
+        return [_journal_line("+", w) for w in added]
+
+    with _LOCK:
+        _edit(key, path, apply)
+        return added
+
+
+def remove_items(key, path, values):
+    """删除词条 (写一条墓碑记录)；返回真正被删掉的词 (库里的原写法)"""
+    removed = []
+
+    def apply(items):
+        removed.extend(w for w in (items.discard(v) for v in values) if w is not None)
+        return [_journal_line("-", w) for w in removed]
+
+    with _LOCK:
+        _edit(key, path, apply)
+        return removed
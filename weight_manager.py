@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from warehouse_manager import CACHE_DIR, normalize_key
+
+# ==========================================
+# 1. 词条权重 (运行期数据，放在 .cache/ 下，不进版本库)
+# ==========================================
+WEIGHTS_FILE = os.path.join(CACHE_DIR, "weights.json")
+
+DEFAULT_WEIGHT = 1.0
+MIN_WEIGHT = 0.1
+MAX_WEIGHT = 20.0
+
+# 反馈事件 -> 乘法系数：被送进自动化流水线的方案里的词变重，被清空的变轻
+FEEDBACK_FACTORS = {
+    "sent": 1.25,
+    "cleared": 0.85,
+}
+
+
+class WeightStore:
+    """{分类: {归一化词: 权重}}，每个分类带一个版本号，别名表据此判断是否要重建"""
+
+    def __init__(self, path=WEIGHTS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.weights = {}
+        self.versions = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.weights = json.load(f)
+        except (OSError, ValueError):
+            self.weights = {}
+
+    def version(self, category):
+        return self.versions.get(category, 0)
+
+    def weights_for(self, category, terms):
+        """按 terms 的顺序返回权重数组 (没记录过的词用默认权重)"""
+        table = self.weights.get(category, {})
+        return np.array([table.get(normalize_key(t), DEFAULT_WEIGHT) for t in terms], dtype=np.float64)
+
+    def record(self, event, terms_by_cat):
+        """
+        event: FEEDBACK_FACTORS 里的事件名
+        terms_by_cat: {分类: [词, ...]}，一次反馈可以涉及多个方案
+        """
+        factor = FEEDBACK_FACTORS.get(event)
+        if factor is None:
+            return
+        with self.lock:
+            for cat, terms in terms_by_cat.items():
+                if not terms:
+                    continue
+                table = self.weights.setdefault(cat, {})
+                for term in terms:
+                    key = normalize_key(term)
+                    w = table.get(key, DEFAULT_WEIGHT) * factor
+                    table[key] = min(max(w, MIN_WEIGHT), MAX_WEIGHT)
+                self.versions[cat] = self.versions.get(cat, 0) + 1
+            self._save_locked()
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.weights, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+_STORE = WeightStore()
+
+
+def get_weight_store():
+    return _STORE
+
+
+def record_feedback(event, terms_by_cat):
+    _STORE.record(event, terms_by_cat)
+
+
+# ==========================================
+# 2. 别名表 (Vose Alias Method)：O(n) 建表，O(1) 抽样
+# ==========================================
+class AliasTable:
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        self.n = n
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        total = weights.sum()
+        if n == 0 or total <= 0:
+            return
+
+        scaled = weights * n / total
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩下的 (浮点误差) 概率都是 1
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def draw(self, rng, size):
+        """一次抽 size 个下标"""
+        i = rng.integers(0, self.n, size=size)
+        keep = rng.random(size) < self.prob[i]
+        return np.where(keep, i, self.alias[i])
+
+
+def weighted_distinct_picks(rng, table, n_rows, k, max_rounds=32):
+    """
+    按别名表无放回地每行抽 k 个 (k 很小)。
+    与前面列重复的行重新抽，几轮之后仍冲突的极少数行按顺延处理。
+    """
+    k = min(k, table.n)
+    picks = np.empty((n_rows, k), dtype=np.int64)
+    for c in range(k):
+        col = table.draw(rng, n_rows)
+        for _ in range(max_rounds):
+            clash = (picks[:, :c] == col[:, None]).any(axis=1) if c else np.zeros(n_rows, dtype=bool)
+            if not clash.any():
+                break
+            col[clash] = table.draw(rng, int(clash.sum()))
+        else:
+            clash = (picks[:, :c] == col[:, None]).any(axis=1)
+            while clash.any():
+                col[clash] = (col[clash] + 1) % table.n
+                clash = (picks[:, :c] == col[:, None]).any(axis=1)
+        picks[:, c] = col
+    return picks